@@ -0,0 +1,43 @@
+import json
+import os
+
+from cover_store import atomic_write
+
+DEFAULT_PATH = 'albums.jsonl'
+
+def manifest_path():
+    return os.getenv('ALBUM_MANIFEST', DEFAULT_PATH)
+
+def album_record(album):
+    """Reduce a Spotify album object to the fields the later stages need"""
+    images = sorted(album.get('images') or [],
+                    key=lambda image: (image.get('width') or 0), reverse=True)
+    return {
+        'id': album.get('id'),
+        'name': album.get('name'),
+        'artists': [artist['name'] for artist in album.get('artists') or []],
+        'images': [
+            {'url': image['url'], 'width': image.get('width'), 'height': image.get('height')}
+            for image in images
+        ],
+    }
+
+def album_label(record):
+    """Human readable 'Album - Artist' line as used in musik.txt"""
+    if record['artists']:
+        return f"{record['name']} - {record['artists'][0]}"
+    return record['name']
+
+def write_manifest(path, records):
+    """Write records as JSON Lines, replacing the file atomically"""
+    lines = [json.dumps(record, ensure_ascii=False) for record in records]
+    data = ('\n'.join(lines) + '\n' if lines else '').encode('utf-8')
+    atomic_write(path, data)
+    return len(lines)
+
+def read_manifest(path):
+    """Yield the album records stored in a manifest"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,178 @@
+"""Local stand-in for the parts of the Spotify Web API this project uses
+
+Serves v1/me/playlists, v1/playlists/{id}/tracks, v1/search and cover
+images for a synthetic library. Latency, page size and throttling (429
+with Retry-After) are configurable, so the client's paging, retry and
+rate-limit paths run exactly as against api.spotify.com.
+
+    python benchmarks/mock_spotify.py --albums 1000 --latency-ms 50 --rate-429 0.05
+    SPOTIFY_API_BASE=http://127.0.0.1:8765/ python main.py
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from synthetic_covers import cover_bytes
+
+PLAYLIST_ID = 'bench'
+PLAYLIST_NAME = 'Benchmark'
+
+# Distinct images actually encoded; album covers cycle through them
+IMAGE_VARIANTS = 64
+
+class MockSpotify:
+    """Threaded HTTP server with one playlist holding albums synthetic albums"""
+
+    def __init__(self, albums=1000, tracks_per_album=1, latency_ms=0, page_size=100,
+                 rate_429=0.0, retry_after=0, port=0, seed=0):
+        self.albums = albums
+        self.tracks_per_album = tracks_per_album
+        self.latency = latency_ms / 1000
+        self.page_size = page_size
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.images = {}
+        self.stats = {'requests': 0, 'throttled': 0, 'images': 0}
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def album(self, index):
+        images = [{'url': f"{self.url}img/{index}/{size}", 'width': size, 'height': size}
+                  for size in (640, 300, 64)]
+        return {'id': f"BENCH{index:06d}", 'name': f"Album {index}",
+                'artists': [{'name': f"Artist {index % 97}"}], 'images': images}
+
+    def image(self, index, size):
+        key = (index % IMAGE_VARIANTS, size)
+        with self.lock:
+            data = self.images.get(key)
+        if data is None:
+            data = cover_bytes(key[0], size)
+            with self.lock:
+                self.images[key] = data
+        return data
+
+    def throttle(self):
+        """Decide whether to answer this API request with 429"""
+        with self.lock:
+            self.stats['requests'] += 1
+            if self.rate_429 and self.rng.random() < self.rate_429:
+                self.stats['throttled'] += 1
+                return True
+        return False
+
+    def tracks_page(self, offset, limit):
+        total = self.albums * self.tracks_per_album
+        items = [{'track': {'album': self.album(position // self.tracks_per_album)}}
+                 for position in range(offset, min(total, offset + limit))]
+        next_url = None
+        if offset + limit < total:
+            next_url = f"{self.url}v1/playlists/{PLAYLIST_ID}/tracks?offset={offset + limit}&limit={limit}"
+        return {'items': items, 'next': next_url, 'total': total}
+
+    def search(self, query):
+        match = re.search(r'album:"Album (\d+)"', query or '')
+        items = []
+        if match and int(match.group(1)) < self.albums:
+            items.append(self.album(int(match.group(1))))
+        return {'albums': {'items': items}}
+
+    def handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Without this the body of each kept-alive response waits for the
+            # client's delayed ACK, and the benchmarks would measure the mock
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def send(self, status, body=b'', content_type='application/json', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_json(self, data):
+                self.send(200, json.dumps(data).encode('utf-8'))
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if mock.latency:
+                    time.sleep(mock.latency)
+
+                if url.path.startswith('/img/'):
+                    _, _, index, size = url.path.split('/')
+                    with mock.lock:
+                        mock.stats['images'] += 1
+                    etag = f'"{index}-{size}"'
+                    if self.headers.get('If-None-Match') == etag:
+                        return self.send(304)
+                    return self.send(200, mock.image(int(index), int(size)), 'image/jpeg',
+                                     {'ETag': etag})
+
+                if mock.throttle():
+                    return self.send(429, headers={'Retry-After': str(mock.retry_after)})
+
+                limit = int(query.get('limit', mock.page_size))
+                offset = int(query.get('offset', 0))
+                if url.path == '/v1/me/playlists':
+                    return self.send_json({'items': [{'id': PLAYLIST_ID, 'name': PLAYLIST_NAME}],
+                                           'next': None})
+                if url.path == f'/v1/playlists/{PLAYLIST_ID}/tracks':
+                    return self.send_json(mock.tracks_page(offset, min(limit, mock.page_size)))
+                if url.path == '/v1/search':
+                    return self.send_json(mock.search(query.get('q')))
+                self.send(404, b'{}')
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--albums', type=int, default=1000)
+    parser.add_argument('--tracks-per-album', type=int, default=1)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=0)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    mock = MockSpotify(args.albums, args.tracks_per_album, args.latency_ms, args.page_size,
+                       args.rate_429, args.retry_after, args.port)
+    print(f"Mock Spotify API auf {mock.url} (Playlist '{PLAYLIST_NAME}', {args.albums} Alben)")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+CoverMix benchmarks
+===================
+
+Runs every stage against the local mock API (mock_spotify.py) and a
+synthetic cover corpus, so the numbers need no network and no account:
+
+- fetch: albums/sec reading the playlist pages
+- download: albums/sec storing covers from manifest records
+- search: albums/sec resolving 'Album - Artist' lines via v1/search
+- collage: ms per create_collage at 10, 100, 1,000 and 5,000 covers
+
+    python benchmarks/run_benchmarks.py --albums 2000 --latency-ms 20 --rate-429 0.02
+    python benchmarks/run_benchmarks.py --only collage --sizes 10,100 --json results.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from mock_spotify import PLAYLIST_NAME, MockSpotify
+from synthetic_covers import generate_corpus
+
+STAGES = ('fetch', 'download', 'search', 'collage')
+DEFAULT_SIZES = '10,100,1000,5000'
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def bench_fetch(client):
+    import playlist_analyzer
+    records, seconds = timed(lambda: list(playlist_analyzer.iter_playlist_albums(PLAYLIST_NAME, client)))
+    return records, {'albums': len(records), 'seconds': seconds,
+                     'albums_per_sec': len(records) / seconds}
+
+def bench_download(records, folder, workers):
+    import cover_downloader
+    from cover_store import CoverStore
+    store = CoverStore(os.path.join(folder, 'photos'))
+    results, seconds = timed(lambda: list(cover_downloader.download_covers(records, store, workers)))
+    store.flush()
+    ok = sum(1 for _, path, _ in results if path)
+    return {'albums': len(records), 'stored': ok, 'seconds': seconds,
+            'albums_per_sec': len(records) / seconds}
+
+def bench_search(records, folder, workers):
+    import cover_downloader
+    from album_manifest import album_label
+    from cover_store import CoverStore
+    store = CoverStore(os.path.join(folder, 'photos-search'))
+    labels = [album_label(record) for record in records]
+    results, seconds = timed(lambda: list(cover_downloader.download_covers(labels, store, workers)))
+    ok = sum(1 for _, path, _ in results if path)
+    return {'albums': len(labels), 'stored': ok, 'seconds': seconds,
+            'albums_per_sec': len(labels) / seconds}
+
+def bench_collage(sizes, corpus, folder, repeat):
+    import collage_maker
+    results = []
+    for count in sizes:
+        paths = generate_corpus(corpus, count)
+        output = os.path.join(folder, f"collage_{count}.jpg")
+        runs = []
+        for _ in range(repeat):
+            # Per-tile log lines would dominate the measurement at large counts
+            with contextlib.redirect_stdout(io.StringIO()):
+                _, seconds = timed(collage_maker.create_collage, paths, output, seed=1)
+            runs.append(seconds)
+        best = min(runs)
+        results.append({'covers': count, 'ms_per_collage': best * 1000,
+                        'runs_ms': [run * 1000 for run in runs]})
+        print(f"   collage {count:>5} Cover: {best * 1000:8.0f} ms")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='CoverMix benchmarks against a local mock API')
+    parser.add_argument('--only', default=','.join(STAGES), help='comma separated subset of ' + ', '.join(STAGES))
+    parser.add_argument('--albums', type=int, default=1000, help='albums in the mock playlist')
+    parser.add_argument('--latency-ms', type=float, default=0, help='added latency per request')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--rate-429', type=float, default=0.0, help='share of API requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=0)
+    parser.add_argument('--rate-limit', type=float, default=1000, help='client requests per second')
+    parser.add_argument('--workers', type=int, default=8, help='download threads')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='cover counts for the collage benchmark')
+    parser.add_argument('--repeat', type=int, default=1, help='collage runs per size (best is reported)')
+    parser.add_argument('--corpus', default=os.path.join(tempfile.gettempdir(), 'covermix-bench-corpus'),
+                        help='folder for the synthetic covers (reused between runs)')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+    stages = [stage.strip() for stage in args.only.split(',') if stage.strip()]
+
+    mock = MockSpotify(args.albums, latency_ms=args.latency_ms, page_size=args.page_size,
+                       rate_429=args.rate_429, retry_after=args.retry_after).start()
+    folder = tempfile.mkdtemp(prefix='covermix-bench-')
+    # The stages read their settings from the environment on first use
+    os.environ.update({
+        'SPOTIFY_API_BASE': mock.url,
+        'SPOTIFY_TOKEN': 'benchmark',
+        'SPOTIFY_RATE_LIMIT': str(args.rate_limit),
+        'DOWNLOAD_CONCURRENCY': str(args.workers),
+        'COVER_CACHE_PATH': os.path.join(folder, 'cover_cache.sqlite'),
+    })
+    from spotify_client import get_client
+
+    results = {'config': vars(args), 'stages': {}}
+    try:
+        records = []
+        if stages != ['collage']:
+            records, fetch = bench_fetch(get_client())
+            if 'fetch' in stages:
+                results['stages']['fetch'] = fetch
+                print(f"   fetch    {fetch['albums_per_sec']:8.0f} Alben/s ({fetch['albums']} Alben)")
+        if 'download' in stages:
+            download = bench_download(records, folder, args.workers)
+            results['stages']['download'] = download
+            print(f"   download {download['albums_per_sec']:8.0f} Alben/s ({download['stored']} gespeichert)")
+        if 'search' in stages:
+            search = bench_search(records, folder, args.workers)
+            results['stages']['search'] = search
+            print(f"   search   {search['albums_per_sec']:8.0f} Alben/s ({search['stored']} gespeichert)")
+        if 'collage' in stages:
+            sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+            results['stages']['collage'] = bench_collage(sizes, args.corpus, folder, args.repeat)
+    finally:
+        mock.stop()
+        shutil.rmtree(folder, ignore_errors=True)
+
+    from metrics import metrics
+    results['mock'] = mock.stats
+    results['metrics'] = metrics.snapshot()
+    print(f"   API-Anfragen: {mock.stats['requests']}, davon 429: {mock.stats['throttled']}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
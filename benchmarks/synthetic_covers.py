@@ -0,0 +1,56 @@
+"""Generate synthetic album covers for benchmarks
+
+Covers are deterministic per index: a two-colour gradient with a few
+shapes, so they compress and resample roughly like real artwork instead
+of flat colour fields.
+"""
+
+import io
+import os
+import random
+import sys
+
+from PIL import Image, ImageDraw
+
+def make_cover(index, size=640):
+    """Return a synthetic RGB cover for index"""
+    rng = random.Random(index)
+    top = tuple(rng.randrange(256) for _ in range(3))
+    bottom = tuple(rng.randrange(256) for _ in range(3))
+    gradient = Image.linear_gradient('L').resize((size, size))
+    img = Image.composite(Image.new('RGB', (size, size), bottom),
+                          Image.new('RGB', (size, size), top), gradient)
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.randint(2, 6)):
+        x0, y0 = rng.randrange(size), rng.randrange(size)
+        r = rng.randint(size // 16, size // 3)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.ellipse((x0 - r, y0 - r, x0 + r, y0 + r), fill=color)
+        else:
+            draw.rectangle((x0 - r, y0 - r, x0 + r, y0 + r), fill=color)
+    return img
+
+def cover_bytes(index, size=640, quality=90):
+    """JPEG bytes of make_cover(index, size)"""
+    buffer = io.BytesIO()
+    make_cover(index, size).save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+def generate_corpus(folder, count, size=640):
+    """Make sure folder holds count covers (bench00000.jpg, ...) and return their paths"""
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = os.path.join(folder, f"bench{index:05d}.jpg")
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(cover_bytes(index, size))
+        paths.append(path)
+    return paths
+
+if __name__ == "__main__":
+    folder = sys.argv[1] if len(sys.argv) > 1 else 'photos'
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    generate_corpus(folder, count)
+    print(f"{count} Cover in {folder}/")
@@ -0,0 +1,169 @@
+"""
+Batch rendering of several collage variants from one cover set
+==============================================================
+
+Every variant (size, seed, output file) gets its own layout, but all of
+them share one decoded image cache. Each cover is decoded once, at the
+largest size any variant needs. The variants are then composited one
+after another from the cached pyramids, each with all tile workers, while
+the previous variant is encoded on a background thread.
+
+    python collage_batch.py phone tablet@7 square 2000x3000@1=poster.jpg
+
+A spec is a preset name or WIDTHxHEIGHT, optionally followed by @SEED and
+=OUTPUT. The output's extension picks the format (see output_encoder.py).
+Without arguments the specs come from COLLAGE_VARIANTS.
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import collage_maker
+from collage_layout import plan_layout
+from image_cache import DecodedImageCache
+from metrics import write_metrics
+from output_encoder import BackgroundEncoder, describe_output, output_path, resolve_format
+
+load_dotenv()
+
+PRESETS = {
+    'phone': (1080, 1920),
+    'tablet': (1536, 2048),
+    'desktop': (2560, 1440),
+    'square': (1080, 1080),
+}
+
+DEFAULT_VARIANTS = 'phone,tablet,desktop,square'
+
+def parse_spec(text):
+    """Parse '<preset|WxH>[@seed][=output]' into a variant dict"""
+    output = None
+    if '=' in text:
+        text, output = text.split('=', 1)
+    seed = None
+    if '@' in text:
+        text, seed = text.split('@', 1)
+        seed = int(seed)
+    if text in PRESETS:
+        name, size = text, PRESETS[text]
+    else:
+        try:
+            width, height = (int(value) for value in text.lower().split('x'))
+        except ValueError:
+            raise ValueError(f"Unbekannte Variante: {text!r}") from None
+        name, size = f"{width}x{height}", (width, height)
+    return {'name': name, 'canvas': size, 'seed': seed, 'output': output}
+
+def variant_output(variant, seed):
+    if variant.get('output'):
+        return variant['output']
+    return f"album_collage_{variant['name']}_{seed}.jpg"
+
+def create_collages(variants, jpg_files=None, cache=None, workers=None, style=None):
+    """Render all variants from one cover set and return one result per variant
+
+    variants are dicts as returned by parse_spec. Results carry name, output,
+    canvas, seed, the seconds spent on planning and rendering and the encoding
+    (quality and size).
+    """
+    if jpg_files is None:
+        jpg_files = collage_maker.get_jpg_files('photos')
+    paths = {collage_maker.cover_id(path): path for path in jpg_files}
+    if not paths:
+        print("Keine JPG-Dateien im photos Ordner gefunden!")
+        return []
+    if cache is None:
+        cache = DecodedImageCache()
+    workers = collage_maker.collage_workers(workers)
+
+    # Plan everything first: the plans decide how large each cover is needed
+    jobs = []
+    for variant in variants:
+        start = time.perf_counter()
+        seed = collage_maker.resolve_seed(variant.get('seed'))
+        variant_style = collage_maker.layout_style(variant.get('style', style))
+        features = collage_maker.layout_features(list(paths.values()), variant_style)
+        plan = plan_layout(list(paths), tuple(variant['canvas']), seed, variant_style, features)
+        # Unsupported formats fail here, before anything is rendered
+        output = variant_output(variant, seed)
+        output = output_path(output, resolve_format(output))
+        jobs.append({
+            'name': variant['name'],
+            'output': output,
+            'canvas': tuple(variant['canvas']),
+            'seed': seed,
+            'plan': plan,
+            'plan_seconds': time.perf_counter() - start,
+        })
+
+    # One decode per cover at the largest size any variant uses. Passing the
+    # same sizes to every render keeps re-decodes after eviction identical.
+    sizes = {}
+    for job in jobs:
+        for cover, size in collage_maker.decode_sizes(job['plan']['tiles']).items():
+            sizes[cover] = max(sizes.get(cover, 0), size)
+    sources = collage_maker.tile_sources(paths, sizes)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda cover: cache.levels(sources[cover], None, (sizes[cover], sizes[cover])),
+                          sizes))
+    decode_seconds = time.perf_counter() - start
+    print(f"🖼️  {len(sizes)} Cover dekodiert in {decode_seconds:.2f}s")
+
+    # Compositing variant n + 1 overlaps with encoding variant n; at most
+    # two full canvases are alive at a time
+    band_height = int(os.getenv('COLLAGE_BAND_HEIGHT', 0))
+    encoded = []
+    with BackgroundEncoder() as encoder:
+        for job in jobs:
+            start = time.perf_counter()
+            if band_height:
+                output = os.path.splitext(job['output'])[0] + '.png'
+                collage_maker.render_plan_banded(job['plan'], paths, output, band_height, cache,
+                                                 workers, sizes)
+                job['output'] = output
+                job['render_seconds'] = time.perf_counter() - start
+            else:
+                canvas = collage_maker.render_plan(job['plan'], paths, cache, workers, sizes)
+                job['render_seconds'] = time.perf_counter() - start
+                if encoded:
+                    # Wait for the previous encode before starting another
+                    encoded[-1][1].result()
+                encoded.append((job, encoder.submit(canvas, job['output'])))
+
+    for job, future in encoded:
+        job['output'], quality, size = future.result()
+        job['encoding'] = describe_output(quality, size)
+    for job in jobs:
+        del job['plan']
+        job['decode_seconds'] = decode_seconds
+    return jobs
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    if not args:
+        args = [spec.strip() for spec in os.getenv('COLLAGE_VARIANTS', DEFAULT_VARIANTS).split(',')
+                if spec.strip()]
+    variants = [parse_spec(arg) for arg in args]
+
+    start = time.perf_counter()
+    results = create_collages(variants)
+    total = time.perf_counter() - start
+    if not results:
+        sys.exit(1)
+
+    print()
+    for job in results:
+        width, height = job['canvas']
+        print(f"🎨 {job['name']:<10} {width}x{height} Seed {job['seed']:<10} "
+              f"Layout {job['plan_seconds']:.2f}s  Rendern {job['render_seconds']:.2f}s  → {job['output']}"
+              + (f" ({job['encoding']})" if job.get('encoding') else ''))
+    print(f"⏱️  {len(results)} Varianten in {total:.2f}s")
+    write_metrics()
+
+if __name__ == "__main__":
+    main()
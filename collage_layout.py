@@ -0,0 +1,517 @@
+"""
+Collage layout
+==============
+
+Pure placement logic: turns cover IDs, canvas size, seed and style into a
+JSON-serializable placement plan. No images are opened here, so a plan can
+be computed, cached, compared or sent to another worker before any pixel
+work happens (see collage_maker.render_plan).
+"""
+
+import hashlib
+import json
+import math
+import random
+
+PLAN_VERSION = 1
+
+DEFAULT_STYLE = {
+    'background': [20, 20, 20],
+    # Base tile size relative to the grid spacing (40% larger than spacing)
+    'oversize': 1.4,
+    # Main grid tiles: size factor range, offset relative to spacing, rotation
+    'main_size': [1.0, 1.4],
+    'main_offset': 0.3,
+    'main_rotation': 8,
+    'main_min_rotation': 1,
+    # Medium gap fillers, as a share of the cover count
+    'gap_ratio': 0.5,
+    'gap_size': [0.6, 0.9],
+    'gap_rotation': 15,
+    'gap_min_rotation': 2,
+    # Small scattered tiles, only for larger collages
+    'scatter_min_covers': 30,
+    'scatter_ratio': 0.25,
+    'scatter_size': [0.3, 0.6],
+    'scatter_rotation': 30,
+    'scatter_min_rotation': 5,
+    # Fillers are only placed on uncovered cells of this size (px, None =
+    # a tenth of the base tile size) until this share of the canvas is covered
+    'coverage_cell': None,
+    'coverage_target': 1.0,
+    # Uncovered cells compared per filler to find the largest hole
+    'coverage_candidates': 8,
+    # Drop tiles whose visible share is at most this (0 = only fully hidden
+    # ones, which keeps the output identical; None = keep every tile)
+    'cull_threshold': 0.0,
+    # Order of the main grid: 'random', 'brightness' (light to dark from
+    # top to bottom), 'hue' (colour gradient) or 'spread' (similar covers
+    # apart); all but 'random' need cover features (see cover_features.py)
+    'order': 'random',
+}
+
+ORDERS = ('random', 'brightness', 'hue', 'spread')
+
+# Below this chroma a cover counts as grey and has no meaningful hue
+MIN_CHROMA = 8
+# Covers whose 64-bit dHashes differ in at most this many bits look alike
+NEAR_DUPLICATE_BITS = 10
+# Later grid positions searched for a cover to swap with a near-duplicate
+DUPLICATE_SEARCH = 64
+
+# Fillers per plan at most: twice the gap and scatter budgets, but never
+# more than twice the main grid cells, plus this many, so a coverage target
+# the fillers cannot reach still terminates
+FILLER_SLACK = 32
+# Largest coverage bitmap; smaller coverage_cell values are raised to fit
+MAX_COVERAGE_CELLS = 1 << 20
+
+# Allowed range of each numeric style value; pairs apply it to both ends
+STYLE_RANGES = {
+    'oversize': (0.1, 3),
+    'main_size': (0.1, 2),
+    'main_offset': (0, 2),
+    'main_rotation': (0, 180),
+    'main_min_rotation': (0, 180),
+    'gap_ratio': (0, 4),
+    'gap_size': (0.05, 2),
+    'gap_rotation': (0, 180),
+    'gap_min_rotation': (0, 180),
+    'scatter_min_covers': (0, 10 ** 6),
+    'scatter_ratio': (0, 4),
+    'scatter_size': (0.05, 2),
+    'scatter_rotation': (0, 180),
+    'scatter_min_rotation': (0, 180),
+    'coverage_cell': (1, 4096),
+    'coverage_candidates': (1, 64),
+    'cull_threshold': (0, 1),
+}
+INTEGER_STYLES = ('scatter_min_covers', 'coverage_candidates')
+# Style values that may be None, see DEFAULT_STYLE
+OPTIONAL_STYLES = ('coverage_cell', 'cull_threshold')
+
+def is_number(value):
+    return (isinstance(value, (int, float)) and not isinstance(value, bool)
+            and math.isfinite(value))
+
+def validate_style(style):
+    """Raise ValueError for style values plan_layout cannot work with"""
+    for key, (low, high) in STYLE_RANGES.items():
+        value = style[key]
+        if value is None and key in OPTIONAL_STYLES:
+            continue
+        if isinstance(DEFAULT_STYLE[key], list):
+            if not isinstance(value, list) or len(value) != 2:
+                raise ValueError(f"{key} muss ein Paar von Zahlen sein: {value!r}")
+            values = value
+        else:
+            values = [value]
+        for number in values:
+            if key in INTEGER_STYLES and not isinstance(number, int):
+                raise ValueError(f"{key} muss eine ganze Zahl sein: {value!r}")
+            if not is_number(number) or not low <= number <= high:
+                raise ValueError(f"{key} muss zwischen {low} und {high} liegen: {value!r}")
+    target = style['coverage_target']
+    if not is_number(target) or not 0 < target <= 1:
+        raise ValueError(f"coverage_target muss zwischen 0 und 1 liegen: {target!r}")
+    background = style['background']
+    if (not isinstance(background, list) or len(background) != 3
+            or not all(isinstance(c, int) and not isinstance(c, bool) and 0 <= c <= 255
+                       for c in background)):
+        raise ValueError(f"background muss eine RGB-Farbe [r, g, b] mit Werten 0-255 sein: {background!r}")
+    if style['order'] not in ORDERS:
+        raise ValueError(f"Unbekannte Reihenfolge: {style['order']!r} (möglich: {', '.join(ORDERS)})")
+
+def resolve_style(style=None):
+    """Merge style overrides into the defaults, raising ValueError for invalid ones"""
+    merged = dict(DEFAULT_STYLE)
+    if style:
+        unknown = set(style) - set(DEFAULT_STYLE)
+        if unknown:
+            raise ValueError(f"Unbekannte Stil-Parameter: {', '.join(sorted(unknown))}")
+        merged.update(style)
+    validate_style(merged)
+    return merged
+
+def collage_grid(num_images, canvas_width, canvas_height, style=None):
+    """Return (cols, rows, spacing_x, spacing_y, base_image_size) for the main grid"""
+    style = resolve_style(style)
+
+    # Calculate optimal grid based on number of images and canvas ratio
+    canvas_ratio = canvas_width / canvas_height  # 1080/1920 = 0.5625
+
+    # For vertical canvas, we want more rows than columns
+    grid_cols = max(3, math.ceil(math.sqrt(num_images * canvas_ratio)))
+    grid_rows = math.ceil(num_images / grid_cols)
+
+    # Ensure we don't create too many empty cells
+    while grid_cols * grid_rows > num_images * 1.5 and grid_cols > 3:
+        grid_cols -= 1
+        grid_rows = math.ceil(num_images / grid_cols)
+
+    # Calculate spacing between cell centers (smaller spacing = more overlap)
+    cell_spacing_x = canvas_width / (grid_cols + 0.5)  # Tighter spacing
+    cell_spacing_y = canvas_height / (grid_rows + 0.5)
+
+    # Base image size - much larger to ensure no gaps
+    base_image_size = max(cell_spacing_x, cell_spacing_y) * style['oversize']
+
+    return grid_cols, grid_rows, cell_spacing_x, cell_spacing_y, base_image_size
+
+def max_tile_size(num_images, canvas_width, canvas_height, style=None):
+    """Largest tile edge a plan can contain with this many covers"""
+    style = resolve_style(style)
+    base_image_size = collage_grid(num_images, canvas_width, canvas_height, style)[4]
+    return int(base_image_size * style['main_size'][1]) + 1
+
+class CoverageGrid:
+    """Low-resolution occupancy bitmap of the canvas
+
+    A cell counts as covered only once a single tile fills it completely, so
+    an uncovered cell may still be partly hidden but never the other way round.
+    """
+
+    def __init__(self, canvas_width, canvas_height, cell):
+        self.width = canvas_width
+        self.height = canvas_height
+        self.cell = cell
+        self.cols = math.ceil(canvas_width / cell)
+        self.rows = math.ceil(canvas_height / cell)
+        self.cells = bytearray(self.cols * self.rows)
+
+    def coverage(self):
+        return 1 - self.cells.count(0) / len(self.cells)
+
+    def cell_rect(self, col, row):
+        x0 = col * self.cell
+        y0 = row * self.cell
+        return x0, y0, min(x0 + self.cell, self.width), min(y0 + self.cell, self.height)
+
+    def cell_range(self, x0, y0, x1, y1):
+        """Columns and rows of the cells touching the pixel box, clipped to the canvas"""
+        cols = range(max(0, int(x0) // self.cell), min(self.cols, math.ceil(x1 / self.cell)))
+        rows = range(max(0, int(y0) // self.cell), min(self.rows, math.ceil(y1 / self.cell)))
+        return cols, rows
+
+    def inner_rows(self, y0, y1):
+        """Rows of cells lying completely between y0 and y1, clipped to the canvas"""
+        first = max(0, math.ceil(y0 / self.cell))
+        last = self.rows if y1 >= self.height else min(self.rows, int(y1 // self.cell))
+        return range(first, last)
+
+    def paint(self, tile):
+        """Mark the cells a (possibly rotated) tile covers completely"""
+        x, y, size = tile['x'], tile['y'], tile['size']
+        half = size / 2
+        cx, cy = x + half, y + half
+        angle = math.radians(tile['rotation'])
+        cos_a, sin_a = math.cos(angle), math.sin(angle)
+
+        def chord(py):
+            """x-interval of the tile on the horizontal line py"""
+            dy = py - cy
+            lo, hi = -math.inf, math.inf
+            # The tile is |dx*cos - dy*sin| <= half and |dx*sin + dy*cos| <= half
+            for a, b in ((cos_a, -dy * sin_a), (sin_a, dy * cos_a)):
+                if abs(a) < 1e-12:
+                    if abs(b) > half:
+                        return 0.0, -1.0
+                    continue
+                left, right = (-half - b) / a, (half - b) / a
+                if left > right:
+                    left, right = right, left
+                lo, hi = max(lo, left), min(hi, right)
+            return lo + cx, hi + cx
+
+        # Rotation keeps the tile size, so the corners are cut off at the box
+        rows = self.inner_rows(y, y + size)
+        cells = self.cells
+        bottom = None
+        for row in rows:
+            y0 = row * self.cell
+            y1 = min(y0 + self.cell, self.height)
+            # Convex tile: a cell is inside iff its top and bottom edges are
+            top_lo, top_hi = bottom if bottom else chord(y0)
+            bottom_lo, bottom_hi = bottom = chord(y1)
+            lo = max(top_lo, bottom_lo, x) - 1e-6
+            hi = min(top_hi, bottom_hi, x + size) + 1e-6
+            if hi <= lo:
+                continue
+            first = max(0, math.ceil(lo / self.cell))
+            last = min(self.cols, int(hi // self.cell))
+            # The clipped last column ends at the canvas edge
+            if last < self.cols and hi >= self.width and last * self.cell < self.width:
+                last = self.cols
+            if last > first:
+                start = row * self.cols
+                cells[start + first:start + last] = b'\x01' * (last - first)
+
+    def pick_uncovered(self, rng):
+        """A pseudo-random uncovered cell index (the next one after a random start)"""
+        start = rng.randrange(len(self.cells))
+        index = self.cells.find(0, start)
+        if index < 0:
+            index = self.cells.find(0)
+        return index
+
+    def uncovered_in(self, x0, y0, x1, y1):
+        """Number of uncovered cells touching the pixel box"""
+        cols, rows = self.cell_range(x0, y0, x1, y1)
+        cells = self.cells
+        return sum(cols.stop - cols.start - sum(cells[row * self.cols + cols.start:
+                                                     row * self.cols + cols.stop])
+                   for row in rows)
+
+    def cell_center(self, index):
+        cx0, cy0, cx1, cy1 = self.cell_rect(index % self.cols, index // self.cols)
+        return (cx0 + cx1) / 2, (cy0 + cy1) / 2
+
+def color_key(lab):
+    """Sort key running through the hue circle, greys last from light to dark"""
+    lightness, a, b = lab
+    if math.hypot(a, b) < MIN_CHROMA:
+        return (1, -lightness)
+    return (0, math.atan2(b, a) % (2 * math.pi))
+
+def hamming(hash_a, hash_b):
+    return bin(hash_a ^ hash_b).count('1')
+
+def separate_duplicates(placed, hashes, cols):
+    """Swap covers so that no cover sits next to or below a near-duplicate, where possible
+
+    hashes maps cover IDs to dHashes as ints. Each position is checked
+    against its left and upper neighbour, which are final by then; a clash
+    is swapped with the first of the next DUPLICATE_SEARCH covers that fits.
+    """
+    def clashes(cover, index):
+        own = hashes.get(cover)
+        if own is None:
+            return False
+        neighbours = []
+        if index % cols:
+            neighbours.append(placed[index - 1])
+        if index >= cols:
+            neighbours.append(placed[index - cols])
+        return any(hashes.get(other) is not None
+                   and hamming(own, hashes[other]) <= NEAR_DUPLICATE_BITS
+                   for other in neighbours)
+
+    for index in range(len(placed)):
+        if not clashes(placed[index], index):
+            continue
+        for candidate in range(index + 1, min(len(placed), index + 1 + DUPLICATE_SEARCH)):
+            if not clashes(placed[candidate], index):
+                placed[index], placed[candidate] = placed[candidate], placed[index]
+                break
+    return placed
+
+def order_covers(cover_ids, order, features, cols, rng):
+    """Arrange shuffled covers for the row-major main grid
+
+    Sorting is O(n log n) on precomputed features; no pixels are read.
+    Gradients keep each row's covers in random order so the rows do not
+    look like a sorted table. Covers without features (e.g. unreadable
+    files) keep their shuffled order after the sorted ones.
+    """
+    if order == 'random':
+        return cover_ids
+    if order not in ORDERS:
+        raise ValueError(f"Unbekannte Reihenfolge: {order}")
+    features = features or {}
+    known = [cover for cover in cover_ids if cover in features]
+    missing = [cover for cover in cover_ids if cover not in features]
+
+    if order == 'brightness':
+        ranked = sorted(known, key=lambda cover: -features[cover]['lab'][0])
+    else:
+        ranked = sorted(known, key=lambda cover: color_key(features[cover]['lab']))
+    ranked += missing
+
+    if order == 'spread':
+        # Deal the colour-sorted covers with a golden-ratio stride, so grid
+        # neighbours (i +- 1, i +- cols) come from distant parts of the circle
+        count = len(ranked)
+        step = max(1, round(count * 0.618))
+        while math.gcd(step, count) != 1:
+            step += 1
+        placed = [None] * count
+        for rank, cover in enumerate(ranked):
+            placed[rank * step % count] = cover
+        # Colour alone does not catch re-releases and deluxe editions
+        hashes = {cover: int(features[cover]['dhash'], 16)
+                  for cover in known if features[cover].get('dhash')}
+        return separate_duplicates(placed, hashes, cols)
+
+    rows = []
+    for start in range(0, len(ranked), cols):
+        row = ranked[start:start + cols]
+        rng.shuffle(row)
+        rows.extend(row)
+    return rows
+
+def pick_rotation(rng, limit, minimum):
+    """Random rotation in [-limit, limit]; small angles are not worth rotating"""
+    rotation = rng.uniform(-limit, limit)
+    return rotation if abs(rotation) > minimum else 0.0
+
+def plan_layout(cover_ids, canvas_size, seed, style=None, features=None):
+    """Build the placement plan for the given covers
+
+    Tiles are listed in paint order. Only a random.Random(seed) is used for
+    randomness, so the same arguments always give the same plan. features
+    maps cover IDs to their entries from cover_features and is only needed
+    for the colour orders.
+    """
+    style = resolve_style(style)
+    canvas_width, canvas_height = canvas_size
+    rng = random.Random(seed)
+
+    # Shuffle images for random placement
+    cover_ids = list(cover_ids)
+    rng.shuffle(cover_ids)
+
+    num_images = len(cover_ids)
+    grid_cols, grid_rows, cell_spacing_x, cell_spacing_y, base_image_size = collage_grid(
+        num_images, canvas_width, canvas_height, style)
+    cover_ids = order_covers(cover_ids, style['order'], features, grid_cols, rng)
+
+    tiles = []
+
+    def add_tile(kind, cover, size, x, y, rotation):
+        tiles.append({'kind': kind, 'cover': cover, 'size': size, 'x': x, 'y': y, 'rotation': rotation})
+
+    # Place each image in its designated cell with controlled randomness
+    for i, cover in enumerate(cover_ids):
+        # Calculate grid position
+        row = i // grid_cols
+        col = i % grid_cols
+
+        # Size variation around base size (larger sizes to fill gaps)
+        image_size = int(base_image_size * rng.uniform(*style['main_size']))
+
+        # Calculate center of the cell
+        cell_center_x = col * cell_spacing_x + cell_spacing_x / 2
+        cell_center_y = row * cell_spacing_y + cell_spacing_y / 2
+
+        # Add random offset for organic look (moderate offset to maintain coverage)
+        max_offset_x = cell_spacing_x * style['main_offset']
+        max_offset_y = cell_spacing_y * style['main_offset']
+
+        final_center_x = cell_center_x + rng.uniform(-max_offset_x, max_offset_x)
+        final_center_y = cell_center_y + rng.uniform(-max_offset_y, max_offset_y)
+
+        # Calculate top-left position
+        x = int(final_center_x - image_size / 2)
+        y = int(final_center_y - image_size / 2)
+
+        # Allow images to extend beyond canvas edges to fill space
+        # but ensure center remains visible
+        min_visible_size = image_size // 3
+        x = max(-image_size + min_visible_size, min(x, canvas_width - min_visible_size))
+        y = max(-image_size + min_visible_size, min(y, canvas_height - min_visible_size))
+
+        # Light rotation for artistic effect
+        rotation = pick_rotation(rng, style['main_rotation'], style['main_min_rotation'])
+        add_tile('main', cover, image_size, x, y, rotation)
+
+    # Fillers go only where no cover is visible yet: medium gap fillers first,
+    # then small scattered ones, then medium ones again until the target is met
+    cell = int(style['coverage_cell'] or max(2, min(16, int(base_image_size / 10))))
+    cell = max(cell, math.ceil(math.sqrt(canvas_width * canvas_height / MAX_COVERAGE_CELLS)))
+    coverage = CoverageGrid(canvas_width, canvas_height, cell)
+    for tile in tiles:
+        coverage.paint(tile)
+
+    gap_budget = int(num_images * style['gap_ratio'])
+    scatter_budget = 0
+    if num_images > style['scatter_min_covers']:
+        scatter_budget = int(num_images * style['scatter_ratio'])
+
+    filler_limit = 2 * min(gap_budget + scatter_budget, grid_cols * grid_rows) + FILLER_SLACK
+    fillers = 0
+    while coverage.coverage() < style['coverage_target'] and fillers < filler_limit:
+        cover = cover_ids[rng.randint(0, num_images - 1)]
+        kind = 'scatter' if gap_budget <= fillers < gap_budget + scatter_budget else 'gap'
+        size = int(base_image_size * rng.uniform(*style[f'{kind}_size']))
+        rotation = pick_rotation(rng, style[f'{kind}_rotation'], style[f'{kind}_min_rotation'])
+        # Big enough to fully cover its cell at any rotation and jitter
+        size = max(size, 3 * coverage.cell)
+
+        # Of a few uncovered cells, take the one with the most open area around it
+        best = None
+        half = size / 2
+        jitter = coverage.cell / 4
+        for _ in range(style['coverage_candidates']):
+            px, py = coverage.cell_center(coverage.pick_uncovered(rng))
+            # Jitter inside the cell so fillers do not line up on the bitmap grid
+            px += rng.uniform(-jitter, jitter)
+            py += rng.uniform(-jitter, jitter)
+            score = coverage.uncovered_in(px - half, py - half, px + half, py + half)
+            if best is None or score > best[0]:
+                best = (score, px, py)
+        _, px, py = best
+
+        tile = {'kind': kind, 'cover': cover, 'size': size,
+                'x': int(px - half), 'y': int(py - half), 'rotation': rotation}
+        tiles.append(tile)
+        coverage.paint(tile)
+        fillers += 1
+
+    plan = {
+        'version': PLAN_VERSION,
+        'canvas': [canvas_width, canvas_height],
+        'seed': seed,
+        'style': style,
+        'grid': {'cols': grid_cols, 'rows': grid_rows, 'base_size': base_image_size},
+        'coverage': coverage.coverage(),
+        'tiles': tiles,
+        'culled': 0,
+    }
+    if style['cull_threshold'] is not None:
+        plan = cull_hidden(plan, style['cull_threshold'], cell)
+    return plan
+
+def cull_hidden(plan, threshold=0.0, cell=None):
+    """Return a copy of plan without tiles that later tiles hide
+
+    Walks the paint order backward, tracking which cells are completely
+    covered by tiles painted later. A tile's visible share is the fraction
+    of the canvas cells it touches that are not covered yet; tiles at or
+    below threshold are dropped (at 0 only tiles with nothing visible).
+    """
+    canvas_width, canvas_height = plan['canvas']
+    if cell is None:
+        cell = max(2, min(16, int(plan['grid']['base_size'] / 10)))
+    occluded = CoverageGrid(canvas_width, canvas_height, cell)
+
+    kept = []
+    for tile in reversed(plan['tiles']):
+        x, y, size = tile['x'], tile['y'], tile['size']
+        cols, rows = occluded.cell_range(x, y, x + size, y + size)
+        total = len(cols) * len(rows)
+        visible = occluded.uncovered_in(x, y, x + size, y + size) if total else 0
+        if total and visible / total > threshold:
+            kept.append(tile)
+            occluded.paint(tile)
+    kept.reverse()
+
+    culled = dict(plan)
+    culled['tiles'] = kept
+    culled['culled'] = plan.get('culled', 0) + len(plan['tiles']) - len(kept)
+    return culled
+
+def plan_hash(plan):
+    """Stable hash of a plan, usable as a cache key for rendered output"""
+    data = json.dumps(plan, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+def save_plan(plan, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, ensure_ascii=False, indent=1)
+
+def load_plan(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        plan = json.load(f)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f"Nicht unterstützte Plan-Version: {plan.get('version')}")
+    return plan
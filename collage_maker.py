@@ -1,19 +1,43 @@
 from PIL import Image
 import os
-import math
 import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+from collage_layout import plan_hash, plan_layout, resolve_style
+from compositor import SMOOTH_BORDER, paste_rotated, resolve_compositor, rotate_tile
+from cover_features import features_for
+from cover_store import INDEX_NAME, indexed_covers, pick_variant, variant_widths
+from image_cache import DecodedImageCache
+from metrics import incr, span, verbose, write_metrics
+from output_encoder import describe_output, resolve_format, save_image
+from png_stream import PNGStreamWriter
+from run_state import CHECKPOINT_SECONDS
+
 # Load environment variables
 load_dotenv()
 
 def get_jpg_files(folder_path):
-    """Get all JPG files from the photos folder"""
+    """Get all JPG files from the photos folder
+
+    In a cover store (a folder with .index.json) only the indexed covers
+    count; files left from older versions, named after the album, would
+    otherwise show up a second time.
+    """
     jpg_files = []
     if os.path.exists(folder_path):
+        known = indexed_covers(folder_path)
+        ignored = 0
         for filename in os.listdir(folder_path):
             if filename.lower().endswith(('.jpg', '.jpeg')):
+                if known is not None and os.path.splitext(filename)[0] not in known:
+                    ignored += 1
+                    continue
                 jpg_files.append(os.path.join(folder_path, filename))
+        if ignored:
+            print(f"{ignored} Bilder ohne Eintrag in {INDEX_NAME} werden ignoriert (alte Cover-Namen)")
     return jpg_files
 
 def resize_image_keep_ratio(image, target_size):
@@ -48,202 +72,337 @@ def resize_image_keep_ratio(image, target_size):
     
     return resized.crop((left, top, right, bottom))
 
-def create_collage():
-    """Create a full-coverage collage where all images are visible with centers preserved"""
-    photos_folder = 'photos'
-    jpg_files = get_jpg_files(photos_folder)
-    
-    if not jpg_files:
-        print("Keine JPG-Dateien im photos Ordner gefunden!")
+def canvas_size():
+    """Canvas settings from environment variables"""
+    return int(os.getenv('COLLAGE_WIDTH', 1080)), int(os.getenv('COLLAGE_HEIGHT', 1920))
+
+def cover_id(path):
+    """Cover ID of a stored file: its name without extension"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+def layout_style(style=None):
+    """Style overrides for plan_layout; COLLAGE_ORDER sets the default order"""
+    style = dict(style or {})
+    if 'order' not in style and os.getenv('COLLAGE_ORDER'):
+        style['order'] = os.getenv('COLLAGE_ORDER')
+    return style
+
+def layout_features(paths, style=None):
+    """Cover features by cover ID when the style's order needs them, else None
+
+    Features come from the index next to the covers; only covers missing
+    there are analysed.
+    """
+    if resolve_style(style)['order'] == 'random':
+        return None
+    with span('features'):
+        return features_for(paths)
+
+def decode_sizes(tiles):
+    """Largest tile size per cover, so every cover is decoded at one fixed scale"""
+    sizes = {}
+    for tile in tiles:
+        sizes[tile['cover']] = max(sizes.get(tile['cover'], 0), tile['size'])
+    return sizes
+
+def tile_sources(paths, sizes):
+    """Per cover, the smallest stored size that still covers its largest tile"""
+    widths = {}
+    sources = {}
+    for cover, size in sizes.items():
+        folder = os.path.dirname(paths[cover])
+        if folder not in widths:
+            widths[folder] = variant_widths(folder)
+        sources[cover] = pick_variant(paths[cover], size, widths[folder])
+    return sources
+
+def prepare_tile(tile, path, cache, decode_size=None, smooth=False):
+    """Load, resize and rotate the image of one tile
+
+    Rotated tiles come back with transparent corners, with smooth also with
+    antialiased edges (see compositor.rotate_tile).
+    """
+    size = tile['size']
+    decode_size = decode_size or size
+    img = cache.get(path, (size, size), (decode_size, decode_size))
+    with span('resample'):
+        img = resize_image_keep_ratio(img, (size, size))
+    if tile['rotation']:
+        # Rotate around center
+        with span('rotate'):
+            img = rotate_tile(img, tile['rotation'], smooth)
+    return img
+
+def log_tile(tile):
+    incr(f"tiles_{tile['kind']}")
+    # One line per tile is slow and noisy with thousands of tiles
+    if not verbose(2):
         return
-    
-    print(f"Gefunden: {len(jpg_files)} Bilder")
-    
-    # Canvas settings from environment variables
-    canvas_width = int(os.getenv('COLLAGE_WIDTH', 1080))
-    canvas_height = int(os.getenv('COLLAGE_HEIGHT', 1920))
-    
-    # Create blank canvas with dark background
-    canvas = Image.new('RGB', (canvas_width, canvas_height), (20, 20, 20))
-    
-    # Shuffle images for random placement
-    random.shuffle(jpg_files)
-    
-    num_images = len(jpg_files)
-    
-    # Calculate optimal grid based on number of images and canvas ratio
-    canvas_ratio = canvas_width / canvas_height  # 1080/1920 = 0.5625
-    
-    # For vertical canvas, we want more rows than columns
-    grid_cols = max(3, math.ceil(math.sqrt(num_images * canvas_ratio)))
-    grid_rows = math.ceil(num_images / grid_cols)
-    
-    # Ensure we don't create too many empty cells
-    while grid_cols * grid_rows > num_images * 1.5 and grid_cols > 3:
-        grid_cols -= 1
-        grid_rows = math.ceil(num_images / grid_cols)
-    
-    # Calculate cell dimensions with heavy overlap to eliminate gaps
-    overlap_factor = 0.5  # 50% overlap between cells for better coverage
-    
-    # Calculate spacing between cell centers (smaller spacing = more overlap)
-    cell_spacing_x = canvas_width / (grid_cols + 0.5)  # Tighter spacing
-    cell_spacing_y = canvas_height / (grid_rows + 0.5)
-    
-    # Base image size - much larger to ensure no gaps
-    base_image_size = max(cell_spacing_x, cell_spacing_y) * 1.4  # 40% larger than spacing
-    
-    print(f"Grid: {grid_rows}x{grid_cols}, Effektive Bildgröße: {base_image_size:.0f}px")
-    
-    # Place each image in its designated cell with controlled randomness
-    for i, jpg_file in enumerate(jpg_files):
+    x, y, size = tile['x'], tile['y'], tile['size']
+    if tile['kind'] == 'main':
+        print(f"✓ Eingefügt: {tile['cover']} bei ({x}, {y}) Größe: {size}px Rotation: {tile['rotation']:.1f}°")
+    elif tile['kind'] == 'gap':
+        print(f"✓ Lückenfüller: bei ({x}, {y}) Größe: {size}px")
+    else:
+        print(f"✓ Streuung: bei ({x}, {y}) Größe: {size}px")
+
+def prepare_tiles(tiles, paths, cache, sizes, executor=None, window=1, smooth=False):
+    """Yield (tile, image, error) in order, preparing up to window tiles ahead
+
+    paths maps cover IDs to files and sizes gives the per-cover decode size
+    (see decode_sizes). Pillow releases the GIL while resampling and
+    rotating, so with an executor tiles are prepared in parallel.
+    """
+    def safe_prepare(tile):
         try:
-            # Load image
-            img = Image.open(jpg_file)
-            
-            # Calculate grid position
-            row = i // grid_cols
-            col = i % grid_cols
-            
-            # Size variation around base size (larger sizes to fill gaps)
-            size_variation = random.uniform(1.0, 1.4)  # All images bigger
-            image_size = int(base_image_size * size_variation)
-            
-            # Resize image
-            img = resize_image_keep_ratio(img, (image_size, image_size))
-            
-            # Calculate center of the cell
-            cell_center_x = col * cell_spacing_x + cell_spacing_x / 2
-            cell_center_y = row * cell_spacing_y + cell_spacing_y / 2
-            
-            # Add random offset for organic look (moderate offset to maintain coverage)
-            max_offset_x = cell_spacing_x * 0.3
-            max_offset_y = cell_spacing_y * 0.3
-            
-            offset_x = random.uniform(-max_offset_x, max_offset_x)
-            offset_y = random.uniform(-max_offset_y, max_offset_y)
-            
-            # Final center position
-            final_center_x = cell_center_x + offset_x
-            final_center_y = cell_center_y + offset_y
-            
-            # Calculate top-left position
-            x = int(final_center_x - image_size / 2)
-            y = int(final_center_y - image_size / 2)
-            
-            # Allow images to extend beyond canvas edges to fill space
-            # but ensure center remains visible
-            min_visible_size = image_size // 3
-            x = max(-image_size + min_visible_size, min(x, canvas_width - min_visible_size))
-            y = max(-image_size + min_visible_size, min(y, canvas_height - min_visible_size))
-            
-            # Light rotation for artistic effect
-            rotation = random.uniform(-8, 8)
-            if abs(rotation) > 1:
-                # Rotate around center
-                img = img.rotate(rotation, expand=False, fillcolor=(20, 20, 20))
-            
-            # Paste image onto canvas
-            canvas.paste(img, (x, y))
-            
-            print(f"✓ Eingefügt: {os.path.basename(jpg_file)} bei ({x}, {y}) Größe: {image_size}px Rotation: {rotation:.1f}°")
-            
+            cover = tile['cover']
+            return prepare_tile(tile, paths[cover], cache, sizes[cover], smooth), None
         except Exception as e:
-            print(f"✗ Fehler bei {jpg_file}: {e}")
-    
-    # Always add extra layer for gap filling regardless of image count
-    print("Fülle verbleibende Lücken mit zusätzlicher Schicht...")
+            return None, e
+
+    if executor is None:
+        for tile in tiles:
+            yield (tile, *safe_prepare(tile))
+        return
+
+    # Keep a bounded window of prepared tiles ahead of the consumer
+    pending = deque()
+    for tile in tiles:
+        pending.append((tile, executor.submit(safe_prepare, tile)))
+        if len(pending) >= window:
+            tile, future = pending.popleft()
+            yield (tile, *future.result())
+    while pending:
+        tile, future = pending.popleft()
+        yield (tile, *future.result())
+
+def paste_tile(canvas, tile, img, offset_y=0):
+    """Paste a prepared tile; rotated tiles carry their own alpha mask"""
+    with span('paste'):
+        paste_rotated(canvas, img, tile['x'], tile['y'] - offset_y)
+
+def resolve_seed(seed=None):
+    """Same seed, same collage (COLLAGE_SEED); a random one otherwise"""
+    if seed is None:
+        seed = os.getenv('COLLAGE_SEED')
+    return int(seed) if seed is not None else random.randrange(2**32)
+
+def collage_workers(workers=None):
+    return workers or int(os.getenv('COLLAGE_WORKERS', os.cpu_count() or 1))
+
+def render_plan(plan, paths, cache=None, workers=None, sizes=None, compositor=None,
+                checkpoint=None):
+    """Render a placement plan from collage_layout into a new canvas
+
+    paths maps the plan's cover IDs to image files. Tiles are prepared on a
+    thread pool; pasting stays serial to keep the paint order. sizes
+    overrides the per-cover decode sizes, e.g. when several plans share
+    one cache. compositor picks 'pillow' (the default) or 'smooth' for
+    antialiased edges, see compositor.py; COLLAGE_COMPOSITOR sets it for
+    all renders.
+
+    With a checkpoint (a run_state.RunState) the canvas is saved every
+    RUN_CHECKPOINT_SECONDS, and a render of the same plan continues after
+    the tiles it already holds.
+    """
+    if cache is None:
+        cache = DecodedImageCache()
+    workers = collage_workers(workers)
+    background = tuple(plan['style']['background'])
+    tiles = plan['tiles']
+    # Decoding at a per-cover scale keeps the output independent of tile order
+    sizes = sizes or decode_sizes(tiles)
+    paths = tile_sources(paths, sizes)
+    compositor = resolve_compositor(compositor)
+    smooth = compositor == 'smooth'
+    canvas = Image.new('RGB', tuple(plan['canvas']), background)
+
+    # A partial canvas only continues a render with the same compositor
+    key = f"{plan_hash(plan)}-{compositor}" if checkpoint else None
+    done = 0
+    if key:
+        resumed = checkpoint.load_render(key)
+        if resumed:
+            done, canvas = resumed
+            tiles = tiles[done:]
+            print(f"↻ Setze bei Kachel {done + 1} fort")
+    last_save = time.monotonic()
+
+    def paste_all(prepared):
+        nonlocal done, last_save
+        for tile, img, error in prepared:
+            done += 1
+            if key and time.monotonic() - last_save >= CHECKPOINT_SECONDS:
+                # Saved before this tile is painted, so the canvas holds done - 1 tiles
+                with span('checkpoint'):
+                    checkpoint.save_render(key, done - 1, canvas)
+                last_save = time.monotonic()
+            if error is not None:
+                print(f"✗ Fehler bei {tile['cover']}: {error}")
+                incr('tiles_failed')
+                continue
+            paste_tile(canvas, tile, img)
+            log_tile(tile)
+
+    if workers <= 1:
+        paste_all(prepare_tiles(tiles, paths, cache, sizes, smooth=smooth))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            paste_all(prepare_tiles(tiles, paths, cache, sizes, executor, workers * 4, smooth))
+    return canvas
+
+def render_plan_banded(plan, paths, output_path, band_height=None, cache=None, workers=None,
+                       sizes=None, compositor=None):
+    """Render a plan strip by strip straight into a PNG file
+
+    Only one horizontal band of the canvas and the tiles crossing it are in
+    memory at a time, so poster-sized canvases do not need a full-size
+    image. A tile spanning several bands is prepared once and kept until
+    the last band it touches has been written.
+    """
+    if cache is None:
+        cache = DecodedImageCache()
+    workers = collage_workers(workers)
+    band_height = band_height or int(os.getenv('COLLAGE_BAND_HEIGHT', 512))
+    canvas_width, canvas_height = plan['canvas']
+    background = tuple(plan['style']['background'])
+    sizes = sizes or decode_sizes(plan['tiles'])
+    paths = tile_sources(paths, sizes)
+    smooth = resolve_compositor(compositor) == 'smooth'
+    # Smoothly rotated tiles reach this far beyond their box
+    margin = SMOOTH_BORDER if smooth else 0
+
+    # Tiles in paint order, started in the band holding their top edge
+    indexed = [(index, tile) for index, tile in enumerate(plan['tiles'])
+               if tile['y'] - margin < canvas_height and tile['y'] + tile['size'] + margin > 0]
+    indexed.sort(key=lambda item: (max(0, item[1]['y'] - margin), item[0]))
+    next_tile = 0
+    active = {}
+
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        with PNGStreamWriter.open(output_path, canvas_width, canvas_height) as writer:
+            for band_top in range(0, canvas_height, band_height):
+                band_bottom = min(band_top + band_height, canvas_height)
+
+                # Prepare the tiles whose top edge lies in this band
+                starting = []
+                while (next_tile < len(indexed)
+                       and max(0, indexed[next_tile][1]['y'] - margin) < band_bottom):
+                    starting.append(indexed[next_tile])
+                    next_tile += 1
+                order = {id(tile): index for index, tile in starting}
+                prepared = prepare_tiles([tile for _, tile in starting], paths, cache, sizes,
+                                         executor, workers * 4, smooth)
+                for tile, img, error in prepared:
+                    if error is not None:
+                        print(f"✗ Fehler bei {tile['cover']}: {error}")
+                        incr('tiles_failed')
+                        continue
+                    active[order[id(tile)]] = (tile, img)
+                    log_tile(tile)
+
+                band = Image.new('RGB', (canvas_width, band_bottom - band_top), background)
+                for index in sorted(active):
+                    tile, img = active[index]
+                    paste_tile(band, tile, img, band_top)
+                with span('encode'):
+                    writer.write_rows(band)
+
+                # Tiles ending in this band are not needed any more
+                for index in [i for i, (tile, _) in active.items()
+                              if tile['y'] + tile['size'] + margin <= band_bottom]:
+                    del active[index]
+    finally:
+        if executor:
+            executor.shutdown()
+    return output_path
+
+def resumed_plan(state, paths, canvas, seed=None, style=None):
+    """The plan saved in a run state, if it was made for the same covers, canvas, seed and style
+
+    Without a seed (argument or COLLAGE_SEED) the saved plan's random seed is taken over.
+    """
+    saved = state.load_plan() if state else None
+    if not saved or saved['covers'] != sorted(paths):
+        return None
+    plan = saved['plan']
+    if list(plan['canvas']) != list(canvas):
+        return None
+    if seed is None:
+        seed = os.getenv('COLLAGE_SEED')
+    if seed is not None and resolve_seed(seed) != plan['seed']:
+        return None
+    return plan if resolve_style(layout_style(style)) == plan['style'] else None
+
+def create_collage(jpg_files=None, output_path='album_collage.jpg', cache=None, seed=None,
+                   workers=None, style=None, band_height=None, state=None, image_format=None,
+                   quality=None, max_bytes=None):
+    """Create a full-coverage collage where all images are visible with centers preserved
+
+    image_format, quality and max_bytes choose the encoding, see
+    output_encoder.py; the format follows output_path's extension by default.
+    With band_height (or COLLAGE_BAND_HEIGHT) the canvas is rendered in
+    strips and streamed to a PNG file, for canvases too large for memory.
+    With a run state (run_state.RunState) the plan and the render progress
+    are checkpointed, and a resumed run renders the same collage.
+    """
+    if jpg_files is None:
+        photos_folder = 'photos'
+        jpg_files = get_jpg_files(photos_folder)
+    paths = {cover_id(path): path for path in jpg_files}
     
-    # First pass: Fill obvious gaps with medium-sized images
-    gap_fill_positions = []
+    if not paths:
+        print("Keine JPG-Dateien im photos Ordner gefunden!")
+        return
     
-    # Create positions between main grid points
-    for row in range(grid_rows + 1):
-        for col in range(grid_cols + 1):
-            x_pos = col * cell_spacing_x
-            y_pos = row * cell_spacing_y
-            
-            # Add some offset positions around edges and between main positions
-            positions_to_try = [
-                (x_pos + cell_spacing_x * 0.5, y_pos + cell_spacing_y * 0.5),
-                (x_pos + cell_spacing_x * 0.25, y_pos + cell_spacing_y * 0.75),
-                (x_pos + cell_spacing_x * 0.75, y_pos + cell_spacing_y * 0.25),
-            ]
-            
-            for px, py in positions_to_try:
-                if 0 <= px <= canvas_width and 0 <= py <= canvas_height:
-                    gap_fill_positions.append((px, py))
+    print(f"Gefunden: {len(paths)} Bilder")
     
-    # Add medium-sized gap fillers
-    gap_count = min(len(gap_fill_positions), num_images // 2)
-    selected_gap_positions = random.sample(gap_fill_positions, min(gap_count, len(gap_fill_positions)))
+    canvas_width, canvas_height = canvas_size()
     
-    for i, (x_pos, y_pos) in enumerate(selected_gap_positions):
-        if i < len(jpg_files):
-            try:
-                img = Image.open(jpg_files[random.randint(0, len(jpg_files)-1)])
-                
-                # Medium size for gap filling
-                gap_size = int(base_image_size * random.uniform(0.6, 0.9))
-                img = resize_image_keep_ratio(img, (gap_size, gap_size))
-                
-                x = int(x_pos - gap_size / 2)
-                y = int(y_pos - gap_size / 2)
-                
-                # Rotation for gap fillers
-                rotation = random.uniform(-15, 15)
-                if abs(rotation) > 2:
-                    img = img.rotate(rotation, expand=False, fillcolor=(20, 20, 20))
-                
-                canvas.paste(img, (x, y))
-                print(f"✓ Lückenfüller: bei ({x}, {y}) Größe: {gap_size}px")
-                
-            except Exception as e:
-                print(f"✗ Fehler bei Lückenfüller: {e}")
+    num_images = len(paths)
+    plan = resumed_plan(state, paths, (canvas_width, canvas_height), seed, style)
+    if plan:
+        print(f"Seed: {plan['seed']} (Plan aus dem letzten Lauf)")
+    else:
+        seed = resolve_seed(seed)
+        print(f"Seed: {seed}")
+        style = layout_style(style)
+        features = layout_features(list(paths.values()), style)
+        with span('layout'):
+            plan = plan_layout(list(paths), (canvas_width, canvas_height), seed, style, features)
+        if state:
+            state.save_plan(plan, sorted(paths))
+    grid = plan['grid']
+    print(f"Grid: {grid['rows']}x{grid['cols']}, Effektive Bildgröße: {grid['base_size']:.0f}px")
+    if plan['culled']:
+        print(f"{plan['culled']} komplett verdeckte Kacheln werden übersprungen")
     
-    # Second pass: Add random scattered small images for final coverage
-    if num_images > 30:
-        print("Füge finale kleine Bilder für komplette Abdeckung hinzu...")
-        
-        # Random scattered positions across the entire canvas
-        scatter_positions = []
-        for _ in range(num_images):
-            x_pos = random.uniform(0, canvas_width)
-            y_pos = random.uniform(0, canvas_height)
-            scatter_positions.append((x_pos, y_pos))
-        
-        # Add small scattered images
-        scatter_count = min(len(scatter_positions), num_images // 4)
+    if band_height is None and os.getenv('COLLAGE_BAND_HEIGHT'):
+        band_height = int(os.getenv('COLLAGE_BAND_HEIGHT'))
+    if band_height:
+        # Strips can only be streamed to PNG, Pillow's JPEG encoder needs the whole image
+        fmt = image_format or os.getenv('COLLAGE_OUTPUT_FORMAT')
+        if (fmt and fmt.lower() != 'png') or quality is not None or max_bytes:
+            raise ValueError("Streifenweises Rendern schreibt PNG; Format, Qualität und "
+                             "Dateigröße lassen sich damit nicht wählen")
+        if not output_path.lower().endswith('.png'):
+            output_path = os.path.splitext(output_path)[0] + '.png'
+        render_plan_banded(plan, paths, output_path, band_height, cache, workers)
+        print(f"\n🎨 Collage gespeichert als: {output_path}")
+    else:
+        # An unsupported format fails before the render, not after
+        image_format = resolve_format(output_path, image_format)
+        # Covers are decoded once and resampled from the nearest pyramid level
+        canvas = render_plan(plan, paths, cache, workers, checkpoint=state)
         
-        for i in range(scatter_count):
-            try:
-                img = Image.open(jpg_files[random.randint(0, len(jpg_files)-1)])
-                
-                # Small size for scattered coverage
-                scatter_size = int(base_image_size * random.uniform(0.3, 0.6))
-                img = resize_image_keep_ratio(img, (scatter_size, scatter_size))
-                
-                x_pos, y_pos = scatter_positions[i]
-                x = int(x_pos - scatter_size / 2)
-                y = int(y_pos - scatter_size / 2)
-                
-                # High rotation for scattered images
-                rotation = random.uniform(-30, 30)
-                if abs(rotation) > 5:
-                    img = img.rotate(rotation, expand=False, fillcolor=(20, 20, 20))
-                
-                canvas.paste(img, (x, y))
-                print(f"✓ Streuung: bei ({x}, {y}) Größe: {scatter_size}px")
-                
-            except Exception as e:
-                print(f"✗ Fehler bei Streuung: {e}")
-    
-    # Save collage
-    output_path = 'album_collage.jpg'
-    canvas.save(output_path, 'JPEG', quality=95)
-    print(f"\n🎨 Collage gespeichert als: {output_path}")
+        # Save collage
+        output_path, quality, size = save_image(canvas, output_path, image_format, quality, max_bytes)
+        print(f"\n🎨 Collage gespeichert als: {output_path} ({describe_output(quality, size)})")
     print(f"Größe: {canvas_width}x{canvas_height} Pixel (9:16 Hochformat)")
     print(f"Alle {num_images} Bilder wurden platziert!")
+    return output_path
 
 if __name__ == "__main__":
-    create_collage()
\ No newline at end of file
+    create_collage()
+    write_metrics()
@@ -0,0 +1,59 @@
+"""
+Tile compositors
+================
+
+The Pillow compositor (COLLAGE_COMPOSITOR=pillow, the default) rotates
+each tile with nearest-neighbour sampling and pastes it through its binary
+alpha mask, which leaves hard, aliased edges. Rotated tiles get
+transparent corners instead of background-coloured ones, so a rotation
+never re-opens a gap that the tiles below already covered.
+
+The smooth compositor (COLLAGE_COMPOSITOR=smooth) antialiases rotated
+edges: the tile gets a transparent one pixel border and is rotated
+bilinearly as premultiplied RGBa, so edge pixels are weighted by how much
+of them the tile covers, and Pillow pastes it with that coverage as alpha.
+Both run in Pillow's C code; smooth edges cost the bilinear resample.
+
+Earlier versions warped tiles in batches on NumPy arrays for the smooth
+edges; that was several times slower than Pillow, so 'numpy' now selects
+the smooth compositor and 'auto' the Pillow one.
+"""
+
+import os
+
+from PIL import Image
+
+COMPOSITORS = ('pillow', 'smooth')
+ALIASES = {'numpy': 'smooth', 'auto': 'pillow'}
+
+# Border around smoothly rotated tiles; they are pasted this much up and left
+SMOOTH_BORDER = 1
+
+def resolve_compositor(choice=None):
+    """Resolve the compositor choice ('pillow' or 'smooth', env COLLAGE_COMPOSITOR)"""
+    choice = (choice or os.getenv('COLLAGE_COMPOSITOR', 'pillow')).lower()
+    choice = ALIASES.get(choice, choice)
+    if choice not in COMPOSITORS:
+        raise ValueError(f"Unbekannter Compositor: {choice} (möglich: {', '.join(COMPOSITORS)})")
+    return choice
+
+def rotate_tile(img, angle, smooth=False):
+    """Rotate a tile around its center, as RGBA with transparent corners
+
+    With smooth the result is premultiplied RGBa with antialiased edges and
+    a SMOOTH_BORDER pixel border on every side.
+    """
+    if not smooth:
+        return img.convert('RGBA').rotate(angle, expand=False)
+    border = SMOOTH_BORDER
+    frame = Image.new('RGBa', (img.width + 2 * border, img.height + 2 * border))
+    frame.paste(img.convert('RGBa'), (border, border))
+    return frame.rotate(angle, Image.BILINEAR)
+
+def paste_rotated(canvas, img, x, y):
+    """Paste a tile from rotate_tile (or an unrotated RGB one) with its top left at (x, y)"""
+    if img.mode == 'RGBa':
+        # Pillow blends a premultiplied RGBa mask as coverage
+        canvas.paste(img, (x - SMOOTH_BORDER, y - SMOOTH_BORDER), img)
+    else:
+        canvas.paste(img, (x, y), img if img.mode == 'RGBA' else None)
@@ -0,0 +1,95 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+DEFAULT_PATH = 'cover_cache.sqlite'
+
+# Found covers barely change, misses are retried after a week by default
+DEFAULT_TTL = 180 * 24 * 3600
+DEFAULT_NEGATIVE_TTL = 7 * 24 * 3600
+
+def normalize_key(album_name, artist_name=''):
+    """Build the lookup key from album and artist, ignoring case, Unicode form and spacing"""
+    def norm(text):
+        text = unicodedata.normalize('NFKC', text or '').casefold()
+        return re.sub(r'\s+', ' ', text).strip()
+    return f"{norm(album_name)}\x1f{norm(artist_name)}"
+
+class CoverCache:
+    """Single-file SQLite store mapping album+artist to the resolved cover"""
+
+    def __init__(self, path=None, ttl=None, negative_ttl=None):
+        self.path = path or os.getenv('COVER_CACHE_PATH', DEFAULT_PATH)
+        self.ttl = float(ttl if ttl is not None else os.getenv('COVER_CACHE_TTL', DEFAULT_TTL))
+        self.negative_ttl = float(negative_ttl if negative_ttl is not None
+                                  else os.getenv('COVER_CACHE_NEGATIVE_TTL', DEFAULT_NEGATIVE_TTL))
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS album_lookup (
+                    key TEXT PRIMARY KEY,
+                    album_id TEXT,
+                    image_url TEXT,
+                    found INTEGER NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+            """)
+
+    def get(self, key):
+        """Return (hit, record) where record is None for a cached miss"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT album_id, image_url, found, fetched_at FROM album_lookup WHERE key = ?',
+                (key,)).fetchone()
+        if row is None:
+            return False, None
+
+        album_id, image_url, found, fetched_at = row
+        ttl = self.ttl if found else self.negative_ttl
+        if ttl > 0 and time.time() - fetched_at > ttl:
+            return False, None
+        if not found:
+            return True, None
+        return True, {'album_id': album_id, 'image_url': image_url}
+
+    def put(self, key, album_id=None, image_url=None):
+        """Store a lookup result; without an image URL it is cached as a miss"""
+        found = 1 if image_url else 0
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO album_lookup (key, album_id, image_url, found, fetched_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, album_id, image_url, found, time.time()))
+
+    def stats(self):
+        """Number of cached lookups, split into found covers and misses"""
+        with self.lock:
+            total, found = self.conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(found), 0) FROM album_lookup').fetchone()
+        return {'entries': total, 'found': found, 'misses': total - found}
+
+    def clear(self, misses_only=False):
+        """Forget cached lookups (only the misses if misses_only), returning how many"""
+        query = 'DELETE FROM album_lookup' + (' WHERE found = 0' if misses_only else '')
+        with self.lock, self.conn:
+            return self.conn.execute(query).rowcount
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+def get_cache():
+    """Return the process-wide lookup cache"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = CoverCache()
+        return _default_cache
@@ -1,33 +1,21 @@
-import requests
-import json
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
+from album_manifest import album_label, manifest_path, read_manifest
+from cover_cache import get_cache, normalize_key
+from cover_store import CoverStore
+from metrics import incr, write_metrics
+from playlist_analyzer import album_key
+from run_state import RunState
+from spotify_client import SpotifyAPIError, fetch_web_api
+
 # Load environment variables from .env file
 load_dotenv()
 
 # Get configuration from environment variables
 token = os.getenv('SPOTIFY_TOKEN')
-
-if not token:
-    print("❌ SPOTIFY_TOKEN nicht in .env gefunden!")
-    print("Bitte konfiguriere deine .env Datei mit:")
-    print("SPOTIFY_TOKEN=dein_token_hier")
-    exit(1)
-
-def fetch_web_api(endpoint, method, body=None):
-    url = f"https://api.spotify.com/{endpoint}"
-    headers = {
-        'Authorization': f'Bearer {token}'
-    }
-    
-    if method == 'GET':
-        response = requests.get(url, headers=headers)
-    elif method == 'POST':
-        headers['Content-Type'] = 'application/json'
-        response = requests.post(url, headers=headers, data=json.dumps(body) if body else None)
-    
-    return response.json()
+concurrency = max(1, int(os.getenv('DOWNLOAD_CONCURRENCY', 8)))
 
 def read_albums_from_file(filename):
     albums = []
@@ -42,77 +30,167 @@ def read_albums_from_file(filename):
         print(f"Datei {filename} nicht gefunden!")
     return albums
 
-def search_album_cover(album_with_artist):
-    # Split album name and artist
+def split_album(album_with_artist):
+    """Split 'Album - Artist' into its parts (artist may be empty)"""
     if ' - ' in album_with_artist:
         album_name, artist_name = album_with_artist.split(' - ', 1)
+        return album_name, artist_name
+    return album_with_artist, ''
+
+def resolve_album(album_with_artist):
+    """Look up album ID and cover URL, using the on-disk cache before v1/search"""
+    album_name, artist_name = split_album(album_with_artist)
+    cache = get_cache()
+    key = normalize_key(album_name, artist_name)
+    hit, record = cache.get(key)
+    if hit:
+        incr('lookup_cache_hits')
+        return record
+    incr('lookup_cache_misses')
+
+    if artist_name:
         query = f'album:"{album_name}" artist:"{artist_name}"'
     else:
-        album_name = album_with_artist
         query = f'album:"{album_name}"'
     
-    result = fetch_web_api(f'v1/search?q={query}&type=album&limit=1', 'GET')
+    result = fetch_web_api('v1/search', 'GET', params={'q': query, 'type': 'album', 'limit': 1})
     
+    record = None
     if 'albums' in result and result['albums']['items']:
         album = result['albums']['items'][0]
         if album['images']:
             # Get the highest quality image (first one is usually highest res)
-            return album['images'][0]['url']
+            record = {'album_id': album['id'], 'image_url': album['images'][0]['url']}
     else:
         print(f"API Error for {album_with_artist}: {result}")
-    return None
+    
+    cache.put(key, **(record or {}))
+    return record
+
+def search_album_cover(album_with_artist):
+    record = resolve_album(album_with_artist)
+    return record['image_url'] if record else None
 
-def download_image(url, filename):
+def download_album(images, store, album_id=None):
+    """Store the cover (and its smaller sizes), returning (path, status) or None on failure"""
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        with open(filename, 'wb') as f:
-            f.write(response.content)
-        return True
+        return store.fetch_album(images, album_id=album_id)
     except Exception as e:
         print(f"Fehler beim Download: {e}")
-        return False
-
-def create_photos_folder():
-    if not os.path.exists('photos'):
-        os.makedirs('photos')
-
-def sanitize_filename(filename):
-    # Remove or replace characters that are not allowed in filenames
-    invalid_chars = '<>:"/\\|?*'
-    for char in invalid_chars:
-        filename = filename.replace(char, '_')
-    return filename
-
-def main():
-    # Create photos folder if it doesn't exist
-    create_photos_folder()
-    
-    # Read albums from musik.txt
-    albums = read_albums_from_file('musik.txt')
-    print(f"Gefundene Alben: {len(albums)}")
+        return None
+
+STATUS_TEXT = {
+    'downloaded': 'Cover heruntergeladen',
+    'not-modified': 'Cover unverändert',
+    'cached': 'Cover bereits vorhanden',
+}
+
+def describe_album(album):
+    """Display name for a manifest record or a musik.txt line"""
+    return album_label(album) if isinstance(album, dict) else album
+
+def store_album(album, store):
+    """Store the cover of one album record (or 'Album - Artist' line), returning (path, message)
+
+    path is None when no cover could be stored.
+    """
+    label = describe_album(album)
+    if isinstance(album, dict):
+        # Manifest records already carry ID and every image size, no search needed
+        album_id, images = album['id'], album['images']
+    else:
+        try:
+            record = resolve_album(album)
+        except SpotifyAPIError as e:
+            return None, f"✗ API-Fehler für {label}: {e}"
+        # The cached search result only knows the largest image
+        album_id = record['album_id'] if record else None
+        images = [{'url': record['image_url']}] if record else []
+    if not images:
+        return None, f"✗ Kein Cover gefunden für: {label}"
+
+    result = download_album(images, store, album_id=album_id)
+    if result:
+        path, status = result
+        return path, f"✓ {STATUS_TEXT[status]}: {path} ({label})"
+    return None, f"✗ Fehler beim Download für: {label}"
+
+def download_covers(albums, store, max_workers=None):
+    """Store albums on a bounded thread pool, yielding (album, path, message) as they finish
+
+    path is None for albums without a stored cover.
+    """
+    max_workers = max_workers or concurrency
+    if max_workers <= 1:
+        for album in albums:
+            print(f"Suche Cover für: {describe_album(album)}")
+            yield (album, *store_album(album, store))
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(store_album, album, store): album for album in albums}
+        for future in as_completed(futures):
+            album = futures[future]
+            try:
+                path, message = future.result()
+            except Exception as e:
+                path, message = None, f"✗ Fehler bei {album}: {e}"
+            yield album, path, message
+
+def checkpoint_key(album):
+    return album_key(album) if isinstance(album, dict) else album
+
+def main(fresh=False):
+    if not token:
+        print("❌ SPOTIFY_TOKEN nicht in .env gefunden!")
+        print("Bitte konfiguriere deine .env Datei mit:")
+        print("SPOTIFY_TOKEN=dein_token_hier")
+        exit(1)
+
+    # Covers are stored by album ID in the photos folder
+    store = CoverStore()
     
-    successful_downloads = 0
+    # Prefer the structured manifest, musik.txt needs a search per album
+    if os.path.exists(manifest_path()):
+        source = manifest_path()
+        albums = list(read_manifest(source))
+    else:
+        source = 'musik.txt'
+        albums = read_albums_from_file(source)
+    print(f"Gefundene Alben: {len(albums)} (parallel: {concurrency})")
     
+    # Albums stored by an unfinished earlier run are not requested again,
+    # as long as their file is still there
+    state = RunState({'source': os.path.abspath(source)}, 'download', fresh=fresh)
+    pending = []
     for album in albums:
-        print(f"Suche Cover für: {album}")
-        cover_url = search_album_cover(album)
-        
-        if cover_url:
-            # Create safe filename
-            safe_filename = sanitize_filename(album)
-            filename = f"photos/{safe_filename}.jpg"
-            
-            if download_image(cover_url, filename):
-                print(f"✓ Cover heruntergeladen: {filename}")
-                successful_downloads += 1
-            else:
-                print(f"✗ Fehler beim Download für: {album}")
+        stored, path = state.cover(checkpoint_key(album))
+        if not (stored and path and os.path.exists(path)):
+            pending.append(album)
+    successful_downloads = len(albums) - len(pending)
+    if successful_downloads:
+        print(f"↻ {successful_downloads} Cover aus dem letzten Lauf")
+    failed = []
+    
+    for album, path, message in download_covers(pending, store):
+        print(message)
+        if path:
+            successful_downloads += 1
+            state.add_cover(checkpoint_key(album), path)
         else:
-            print(f"✗ Kein Cover gefunden für: {album}")
+            failed.append(describe_album(album))
     
-    print(f"\nFertig! {successful_downloads}/{len(albums)} Cover erfolgreich heruntergeladen.")
+    store.flush()
+    if failed:
+        state.close()
+    else:
+        state.finish()
+    write_metrics()
+    print(f"\nFertig! {successful_downloads}/{len(albums)} Cover verfügbar.")
+    if failed:
+        print("Ohne Cover:")
+        for album in sorted(failed):
+            print(f"   - {album}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,143 @@
+import os
+import threading
+
+from PIL import Image
+
+from cover_store import JsonIndex
+
+FEATURES_NAME = '.features.json'
+
+# Covers are analysed at this size; features do not need more detail
+THUMB_SIZE = 32
+# The average Lab colour is converted pixel by pixel in Python, on a smaller thumbnail
+LAB_SIZE = 16
+DOMINANT_COLORS = 4
+
+def srgb_to_lab(r, g, b):
+    """CIE L*a*b* (D65) of an 8-bit sRGB colour"""
+    def linear(c):
+        c /= 255
+        return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+    r, g, b = linear(r), linear(g), linear(b)
+    x = (0.4124 * r + 0.3576 * g + 0.1805 * b) / 0.95047
+    y = 0.2126 * r + 0.7152 * g + 0.0722 * b
+    z = (0.0193 * r + 0.1192 * g + 0.9505 * b) / 1.08883
+
+    def f(t):
+        return t ** (1 / 3) if t > 0.008856 else 7.787 * t + 16 / 116
+    fx, fy, fz = f(x), f(y), f(z)
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+def dhash(img):
+    """64-bit difference hash as 16 hex digits; near-identical covers differ in few bits"""
+    small = img.convert('L').resize((9, 8), Image.Resampling.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            bits = (bits << 1) | (left > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+def compute_features(img):
+    """Dominant colours, average Lab and dHash of a decoded cover"""
+    thumb = img.convert('RGB').resize((THUMB_SIZE, THUMB_SIZE), Image.Resampling.BOX)
+    pixels = list(thumb.getdata())
+    labs = [srgb_to_lab(*pixel) for pixel in thumb.reduce(THUMB_SIZE // LAB_SIZE).getdata()]
+    lab = [sum(channel) / len(labs) for channel in zip(*labs)]
+
+    quantized = thumb.quantize(DOMINANT_COLORS, method=Image.Quantize.MEDIANCUT)
+    palette = quantized.getpalette()
+    colors = []
+    for count, index in sorted(quantized.getcolors(), reverse=True):
+        rgb = palette[index * 3:index * 3 + 3]
+        colors.append({'rgb': rgb, 'share': round(count / len(pixels), 3)})
+
+    return {
+        'lab': [round(value, 2) for value in lab],
+        'colors': colors,
+        'dhash': dhash(thumb),
+    }
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+class FeatureIndex:
+    """Cover features stored next to the covers in .features.json
+
+    Entries are keyed by cover ID (file name without extension) and carry
+    the file's mtime and size, so replaced covers are analysed again.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, FEATURES_NAME)
+        self.index = JsonIndex(self.path, separators=(',', ':'))
+
+    @staticmethod
+    def key(path):
+        return os.path.splitext(os.path.basename(path))[0]
+
+    def get(self, path):
+        """Stored features of the cover at path, or None when missing or stale"""
+        entry = self.index.get(self.key(path))
+        if entry is None:
+            return None
+        try:
+            if entry['stamp'] != file_stamp(path):
+                return None
+        except OSError:
+            return None
+        return entry
+
+    def add(self, path, img=None):
+        """Analyse a cover (reusing an already decoded img) and store its features"""
+        entry = self.get(path)
+        if entry is not None:
+            return entry
+        if img is None:
+            with Image.open(path) as source:
+                # A draft decode at 1/8 scale is plenty for 32 px features
+                source.draft('RGB', (THUMB_SIZE * 2, THUMB_SIZE * 2))
+                entry = compute_features(source)
+        else:
+            entry = compute_features(img)
+        entry['stamp'] = file_stamp(path)
+        self.index.set(self.key(path), entry)
+        return entry
+
+    def ensure(self, paths):
+        """Features for all paths by cover ID, analysing only new or changed covers"""
+        features = {}
+        for path in paths:
+            try:
+                features[self.key(path)] = self.add(path)
+            except OSError as e:
+                print(f"✗ Merkmale nicht berechenbar: {path} ({e})")
+        self.flush()
+        return features
+
+    def flush(self):
+        self.index.flush()
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(root):
+    """Shared FeatureIndex for a cover folder"""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        if root not in _indexes:
+            _indexes[root] = FeatureIndex(root)
+        return _indexes[root]
+
+def features_for(paths):
+    """Features of covers that may live in different folders, keyed by cover ID"""
+    by_folder = {}
+    for path in paths:
+        by_folder.setdefault(os.path.dirname(path) or '.', []).append(path)
+    features = {}
+    for folder, folder_paths in by_folder.items():
+        features.update(get_index(folder).ensure(folder_paths))
+    return features
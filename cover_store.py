@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from metrics import incr, span
+
+DEFAULT_ROOT = 'photos'
+INDEX_NAME = '.index.json'
+# Smaller sizes of a cover live in photos/sizes/<width>/<key>.jpg; the
+# largest one stays photos/<key>.jpg so the cover folder looks as before
+VARIANTS_DIR = 'sizes'
+
+# Write the index after this many changes so a crash loses little work
+FLUSH_EVERY = 50
+
+def cover_key(album_id=None, url=None):
+    """Stable file key: the Spotify album ID, or a hash of the image URL"""
+    if album_id:
+        return album_id
+    return 'u' + hashlib.sha1(url.encode('utf-8')).hexdigest()[:20]
+
+def variant_widths(root):
+    """Widths with a variant folder under root, ascending"""
+    try:
+        names = os.listdir(os.path.join(root, VARIANTS_DIR))
+    except FileNotFoundError:
+        return []
+    return sorted(int(name) for name in names if name.isdigit())
+
+def pick_variant(path, size, widths=None):
+    """Smallest stored variant of the cover at path that is at least size pixels wide
+
+    Falls back to path itself, the largest version. widths can be passed
+    in (see variant_widths) to avoid listing the folder for every cover.
+    """
+    folder, name = os.path.split(path)
+    if widths is None:
+        widths = variant_widths(folder)
+    for width in widths:
+        if width >= size:
+            candidate = os.path.join(folder, VARIANTS_DIR, str(width), name)
+            if os.path.exists(candidate):
+                return candidate
+    return path
+
+# mkstemp creates 0600 files; replaced files get the usual mode instead
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def temp_file(folder):
+    """mkstemp in folder, with the permissions a plain open() would give"""
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.tmp-')
+    os.fchmod(fd, 0o666 & ~_UMASK)
+    return fd, tmp_path
+
+def read_json(path):
+    """JSON content of path, or None if it is missing or unreadable"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def indexed_covers(root):
+    """Cover keys listed in the index under root, or None if root has no index"""
+    index = read_json(os.path.join(root, INDEX_NAME))
+    if index is None:
+        return None
+    return {key for key in index if '@' not in key}
+
+def atomic_write(path, data):
+    """Write bytes to path via a temporary file and rename"""
+    folder = os.path.dirname(path) or '.'
+    fd, tmp_path = temp_file(folder)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class JsonIndex:
+    """Thread-safe dict persisted as one JSON file, written every FLUSH_EVERY changes
+
+    json_options are passed to json.dumps, e.g. indent for a readable file.
+    """
+
+    def __init__(self, path, **json_options):
+        self.path = path
+        self.json_options = json_options
+        self.entries = read_json(path) or {}
+        self.lock = threading.Lock()
+        # Held from snapshot to rename, so an older index never replaces a newer one
+        self.write_lock = threading.Lock()
+        self.dirty = 0
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def items(self):
+        with self.lock:
+            return list(self.entries.items())
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.dirty += 1
+            flush = self.dirty >= FLUSH_EVERY
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Persist the index if anything changed"""
+        with self.write_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                data = json.dumps(self.entries, **self.json_options).encode('utf-8')
+                self.dirty = 0
+            atomic_write(self.path, data)
+
+class CoverStore:
+    """Content-addressed folder of cover images with an HTTP validator index"""
+
+    def __init__(self, root=None, revalidate=None, variants=None, on_change=None):
+        self.root = root or os.getenv('COVER_STORE_DIR', DEFAULT_ROOT)
+        if revalidate is None:
+            revalidate = os.getenv('COVER_REVALIDATE', '1') not in ('0', 'false', 'no')
+        if variants is None:
+            variants = os.getenv('COVER_VARIANTS', '1') not in ('0', 'false', 'no')
+        self.revalidate = revalidate
+        self.variants = variants
+        # Called with the path of a stored file that a download replaced
+        self.on_change = on_change
+        os.makedirs(self.root, exist_ok=True)
+        self.index = JsonIndex(os.path.join(self.root, INDEX_NAME), ensure_ascii=False, indent=1)
+
+    def stats(self):
+        """Counts and bytes of the stored covers and their smaller variants"""
+        entries = self.index.items()
+        covers = [entry for key, entry in entries if '@' not in key]
+        return {
+            'covers': len(covers),
+            'variants': len(entries) - len(covers),
+            'bytes': sum(entry.get('size') or 0 for _, entry in entries),
+        }
+
+    def fetch_album(self, images, album_id=None):
+        """Store the largest image as the cover and, if enabled, the smaller sizes as variants
+
+        images are {'url', 'width', 'height'} dicts sorted by width, largest
+        first, as in album manifest records. Returns the result of storing
+        the largest image; failing variants are skipped.
+        """
+        result = self.fetch(images[0]['url'], album_id)
+        if self.variants:
+            # Variants are keyed like the cover, so URL-keyed covers keep theirs together
+            key = cover_key(album_id, images[0]['url'])
+            for image in images[1:]:
+                if not image.get('width') or image['width'] >= (images[0].get('width') or 0):
+                    continue
+                try:
+                    self.fetch(image['url'], key, image['width'])
+                except Exception as e:
+                    incr('variant_errors')
+                    print(f"Variante {image['width']}px nicht gespeichert: {e}")
+        return result
+
+    def flush(self):
+        """Persist the index if anything changed"""
+        self.index.flush()
+
+    def path_for(self, key, width=None):
+        if width:
+            return os.path.join(self.root, VARIANTS_DIR, str(width), f"{key}.jpg")
+        return os.path.join(self.root, f"{key}.jpg")
+
+    def fetch(self, url, album_id=None, width=None):
+        """Make sure the cover is stored, returning (path, status)
+
+        status is 'cached' (no request), 'not-modified' (validated with a
+        conditional request) or 'downloaded'. With width the image is stored
+        as a smaller variant of the cover instead of the cover itself.
+        """
+        key = cover_key(album_id, url)
+        path = self.path_for(key, width)
+        if width:
+            key = f"{key}@{width}"
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = dict(self.index.get(key) or {})
+
+        known = os.path.exists(path) and entry.get('url') == url
+        if known and not self.revalidate:
+            incr('covers_cached')
+            return path, 'cached'
+
+        headers = {}
+        if known:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+            if not headers:
+                # Nothing to validate against, the file is all we have
+                incr('covers_cached')
+                return path, 'cached'
+
+        # requests is only loaded once something has to be downloaded
+        from spotify_client import get_client
+        with span('download'):
+            response = get_client().get(url, headers=headers)
+        if known and response.status_code == 304:
+            incr('covers_not_modified')
+            return path, 'not-modified'
+
+        incr('covers_downloaded')
+        incr('download_bytes', len(response.content))
+        replaced = os.path.exists(path)
+        atomic_write(path, response.content)
+        if replaced and self.on_change:
+            self.on_change(path)
+        entry = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'size': len(response.content),
+        }
+        self.index.set(key, entry)
+        return path, 'downloaded'
@@ -0,0 +1,120 @@
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from metrics import incr, span
+
+# Smallest pyramid level worth keeping (in pixels, shorter side)
+MIN_LEVEL_SIZE = 64
+
+def image_bytes(img):
+    return img.width * img.height * len(img.getbands())
+
+def build_pyramid(img):
+    """Return the image and successive 2x box reductions, largest first"""
+    levels = [img]
+    while min(levels[-1].size) // 2 >= MIN_LEVEL_SIZE:
+        levels.append(levels[-1].reduce(2))
+    return levels
+
+def pick_level(levels, target_size):
+    """Smallest level that still covers target_size without upscaling"""
+    if not target_size:
+        return levels[0]
+    best = levels[0]
+    for level in levels:
+        if level.width >= target_size[0] and level.height >= target_size[1]:
+            best = level
+        else:
+            break
+    return best
+
+class DecodedImageCache:
+    """LRU cache of decoded covers, bounded by the bytes of all pyramid levels"""
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(os.getenv('COLLAGE_CACHE_MB', 512)) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def decode(self, path, target_size=None):
+        """Decode path; JPEGs are decoded at a reduced scale when target_size allows"""
+        with span('decode'):
+            img = Image.open(path)
+            source_size = img.size
+            if target_size and img.format == 'JPEG':
+                # libjpeg scales by 1/2, 1/4 or 1/8 while decoding, never below target_size
+                img.draft('RGB', tuple(target_size))
+            img.load()
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+        return img, source_size
+
+    def add(self, path, img, source_size=None):
+        """Insert an already decoded image, replacing an older entry"""
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        with span('pyramid'):
+            levels = build_pyramid(img)
+        size = sum(image_bytes(level) for level in levels)
+        complete = source_size is None or img.size == tuple(source_size)
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old:
+                self.size -= old[1]
+            self.entries[path] = (levels, size, complete)
+            self.size += size
+            self.evict()
+        return levels
+
+    def evict(self):
+        # Always keep the newest entry, even if it alone exceeds the budget
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, (_, size, _) = self.entries.popitem(last=False)
+            self.size -= size
+            incr('image_cache_evictions')
+
+    def discard(self, path):
+        """Forget path, e.g. after the file was replaced"""
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry:
+                self.size -= entry[1]
+
+    def levels(self, path, target_size=None, decode_size=None):
+        """Return the pyramid for path, decoding it on a miss
+
+        A cover that was draft-decoded too small for target_size is decoded
+        again at the scale now needed. decode_size (at least target_size)
+        fixes the draft scale independent of which tile asks first.
+        """
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry:
+                levels, _, complete = entry
+                top = levels[0]
+                if complete or (target_size and top.width >= target_size[0]
+                                and top.height >= target_size[1]):
+                    self.entries.move_to_end(path)
+                    self.hits += 1
+                    incr('image_cache_hits')
+                    return levels
+            self.misses += 1
+            incr('image_cache_misses')
+        img, source_size = self.decode(path, decode_size or target_size)
+        return self.add(path, img, source_size)
+
+    def get(self, path, target_size=None, decode_size=None):
+        """Return the smallest cached level of path that covers target_size"""
+        return pick_level(self.levels(path, target_size, decode_size), target_size)
+
+    def __contains__(self, path):
+        with self.lock:
+            return path in self.entries
@@ -8,12 +8,17 @@ Main script that orchestrates the entire workflow:
 2. Download album covers from Spotify
 3. Create a beautiful collage from the covers
 
+All three steps run in this process as a streaming pipeline (see pipeline.py).
+The single steps and the other tools are subcommands (python main.py --help).
+Each subcommand imports only the modules it needs, so help, dry runs and
+cache commands do not pay for requests or Pillow.
+
 Author: Generated with Claude Code
 """
 
-import subprocess
-import sys
+import argparse
 import os
+import sys
 from pathlib import Path
 
 def print_header():
@@ -30,48 +35,20 @@ def print_step(step_num, title, description):
     print(f"   {description}")
     print()
 
-def run_script(script_name, description):
-    """Run a Python script and handle errors"""
-    try:
-        print(f"▶️  Starte {script_name}...")
-        
-        # Run the script in the same virtual environment
-        result = subprocess.run([
-            sys.executable, script_name
-        ], capture_output=True, text=True, cwd=os.getcwd())
-        
-        if result.returncode == 0:
-            print(f"✅ {description} erfolgreich abgeschlossen!")
-            if result.stdout:
-                print("Ausgabe:")
-                print(result.stdout)
-        else:
-            print(f"❌ Fehler beim Ausführen von {script_name}:")
-            if result.stderr:
-                print("Fehlermeldung:")
-                print(result.stderr)
-            if result.stdout:
-                print("Ausgabe:")
-                print(result.stdout)
-            return False
-            
-    except Exception as e:
-        print(f"❌ Unerwarteter Fehler beim Ausführen von {script_name}: {e}")
-        return False
-    
-    return True
-
 def check_dependencies():
     """Check if all required files exist"""
     required_files = [
         "playlist_analyzer.py",
         "cover_downloader.py", 
-        "collage_maker.py"
+        "collage_maker.py",
+        "pipeline.py"
     ]
     
+    # The stages are imported from next to this script
+    base_dir = Path(__file__).resolve().parent
     missing_files = []
     for file in required_files:
-        if not Path(file).exists():
+        if not (base_dir / file).exists():
             missing_files.append(file)
     
     if missing_files:
@@ -108,8 +85,8 @@ def check_spotify_token():
     print("   3. Oder bearbeite playlist_analyzer.py direkt")
     return False
 
-def main():
-    """Main function that runs the complete workflow"""
+def run_workflow(args):
+    """Run the complete workflow for one playlist"""
     print_header()
     
     # Check dependencies
@@ -122,46 +99,24 @@ def main():
         print("\n⚠️  Warnung: Spotify-Token nicht konfiguriert.")
         print("   Das Programm wird möglicherweise fehlschlagen.")
         
-        response = input("\nTrotzdem fortfahren? (j/n): ").lower().strip()
-        if response not in ['j', 'ja', 'y', 'yes']:
-            print("Programm beendet.")
-            sys.exit(1)
+        if not args.yes:
+            response = input("\nTrotzdem fortfahren? (j/n): ").lower().strip()
+            if response not in ['j', 'ja', 'y', 'yes']:
+                print("Programm beendet.")
+                sys.exit(1)
     
     print("\n🚀 Starte Workflow...")
     
-    # Step 1: Analyze playlist and extract albums
-    print_step(1, "PLAYLIST ANALYSE", 
-               "Analysiere Spotify-Playlist und extrahiere Album-Informationen")
+    # Fetch, download and compose overlap, so there is one combined step
+    print_step("1-3", "PLAYLIST → COVER → COLLAGE", 
+               "Analysiere die Playlist, lade Cover und erstelle die Collage in einem Durchlauf")
     
-    if not run_script("playlist_analyzer.py", "Playlist-Analyse"):
-        print("\n❌ Workflow abgebrochen.")
-        sys.exit(1)
-    
-    # Check if musik.txt was created
-    if not Path("musik.txt").exists():
-        print("\n❌ musik.txt wurde nicht erstellt. Workflow abgebrochen.")
-        sys.exit(1)
-    
-    # Step 2: Download album covers
-    print_step(2, "COVER DOWNLOAD", 
-               "Lade Album-Cover von Spotify herunter")
-    
-    if not run_script("cover_downloader.py", "Cover-Download"):
-        print("\n❌ Workflow abgebrochen.")
-        sys.exit(1)
-    
-    # Check if photos directory has files
-    photos_dir = Path("photos")
-    if not photos_dir.exists() or not any(photos_dir.glob("*.jpg")):
-        print("\n❌ Keine Album-Cover heruntergeladen. Workflow abgebrochen.")
-        sys.exit(1)
-    
-    # Step 3: Create collage
-    print_step(3, "COLLAGE ERSTELLEN", 
-               "Erstelle eine künstlerische Collage aus allen Album-Covern")
+    from pipeline import run_pipeline
+    summary = run_pipeline(args.playlist, args.output, resume=True, fresh=args.fresh)
     
-    if not run_script("collage_maker.py", "Collage-Erstellung"):
+    if summary['errors'] or not summary['output']:
         print("\n❌ Workflow abgebrochen.")
+        print("   Ein erneuter Aufruf setzt beim letzten Stand fort (--fresh beginnt neu).")
         sys.exit(1)
     
     # Success!
@@ -169,9 +124,18 @@ def main():
     print("🎉 WORKFLOW ERFOLGREICH ABGESCHLOSSEN! 🎉")
     print("=" * 60)
     
+    timings = summary['timings']
+    print("⏱️  " + ", ".join(f"{stage}: {seconds:.1f}s" for stage, seconds in timings.items()))
+    from metrics import write_metrics
+    metrics_path = write_metrics()
+    if metrics_path:
+        print(f"📊 Metriken gespeichert: {metrics_path}")
+    if summary['failed']:
+        print(f"⚠️  {len(summary['failed'])} Alben ohne Cover")
+    
     # Show results
-    if Path("album_collage.jpg").exists():
-        print("✅ Collage erstellt: album_collage.jpg")
+    if Path(summary['output']).exists():
+        print(f"✅ Collage erstellt: {summary['output']}")
     
     if Path("musik.txt").exists():
         # Count albums in musik.txt
@@ -180,12 +144,188 @@ def main():
             album_count = len([line for line in lines if line.strip().startswith("- ")])
         print(f"✅ Album-Liste: musik.txt ({album_count} Alben)")
     
-    if photos_dir.exists():
-        cover_count = len(list(photos_dir.glob("*.jpg")))
-        print(f"✅ Album-Cover: photos/ ({cover_count} Bilder)")
+    print(f"✅ Album-Cover: photos/ ({summary['covers']} Bilder in der Collage)")
     
     print("\n📂 Alle Dateien befinden sich im aktuellen Verzeichnis.")
-    print("🖼️  Öffne 'album_collage.jpg' um deine Collage zu sehen!")
+    print(f"🖼️  Öffne '{summary['output']}' um deine Collage zu sehen!")
+
+def run_fetch(args):
+    import playlist_analyzer
+    playlist_analyzer.main(args.playlist)
+
+def run_download(args):
+    import cover_downloader
+    cover_downloader.main(fresh=args.fresh)
+
+def run_collage(args):
+    import collage_maker
+    from metrics import write_metrics
+    style = {'order': args.order} if args.order else None
+    files = collage_maker.get_jpg_files(args.photos)
+    max_bytes = int(args.max_kb * 1024) if args.max_kb else None
+    if not collage_maker.create_collage(files, args.output, seed=args.seed, style=style,
+                                        band_height=args.band_height, image_format=args.format,
+                                        quality=args.quality, max_bytes=max_bytes):
+        sys.exit(1)
+    write_metrics()
+
+def run_plan(args):
+    """Compute the layout only: no decoding, rendering or network"""
+    import collage_layout
+    import collage_maker
+    files = collage_maker.get_jpg_files(args.photos)
+    if not files:
+        print(f"Keine JPG-Dateien im {args.photos} Ordner gefunden!")
+        sys.exit(1)
+    paths = {collage_maker.cover_id(path): path for path in files}
+    width, height = collage_maker.canvas_size()
+    seed = collage_maker.resolve_seed(args.seed)
+    style = collage_maker.layout_style({'order': args.order} if args.order else None)
+    features = collage_maker.layout_features(list(paths.values()), style)
+    plan = collage_layout.plan_layout(list(paths), (args.width or width, args.height or height),
+                                      seed, style, features)
+    kinds = {}
+    for tile in plan['tiles']:
+        kinds[tile['kind']] = kinds.get(tile['kind'], 0) + 1
+    grid = plan['grid']
+    print(f"Seed: {seed}")
+    print(f"Grid: {grid['rows']}x{grid['cols']}, Effektive Bildgröße: {grid['base_size']:.0f}px")
+    print("Kacheln: " + ", ".join(f"{kind} {count}" for kind, count in sorted(kinds.items()))
+          + f" ({plan['culled']} verdeckt, übersprungen)")
+    print(f"Abdeckung: {plan['coverage'] * 100:.1f}%")
+    print(f"Plan-Hash: {collage_layout.plan_hash(plan)}")
+    if args.save:
+        collage_layout.save_plan(plan, args.save)
+        print(f"Plan gespeichert: {args.save}")
+
+def run_variants(args):
+    import collage_batch
+    collage_batch.main(args.specs)
+
+def run_batch(args):
+    import playlist_batch
+    playlist_batch.main(args.jobs)
+
+def run_serve(args):
+    import render_server
+    render_server.main(args.host or render_server.HOST, args.port or render_server.PORT)
+
+def run_cache(args):
+    """Show (and optionally clear) the lookup cache and the cover store"""
+    from cover_cache import get_cache
+    from cover_store import CoverStore
+    cache = get_cache()
+    if args.clear or args.clear_misses:
+        removed = cache.clear(misses_only=args.clear_misses)
+        print(f"🧹 {removed} Einträge aus {cache.path} gelöscht")
+    lookups = cache.stats()
+    print(f"🔎 Such-Cache {cache.path}: {lookups['entries']} Einträge "
+          f"({lookups['found']} gefunden, {lookups['misses']} ohne Treffer)")
+    store = CoverStore()
+    covers = store.stats()
+    print(f"🖼️  Cover-Ordner {store.root}/: {covers['covers']} Cover, {covers['variants']} kleinere "
+          f"Größen, {covers['bytes'] / 1024 / 1024:.1f} MB")
+
+def quality_value(text):
+    """argparse type: an encoder quality from 1 to 100"""
+    quality = int(text)
+    if not 1 <= quality <= 100:
+        raise argparse.ArgumentTypeError("Qualität muss zwischen 1 und 100 liegen")
+    return quality
+
+def size_kb(text):
+    """argparse type: a positive, finite size in KB"""
+    kb = float(text)
+    if not 0 < kb * 1024 < float('inf'):
+        raise argparse.ArgumentTypeError("Größe muss eine positive Zahl sein")
+    return kb
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='main.py', description='Spotify Album Cover Collage Generator',
+        epilog='Ohne Befehl läuft "run": Playlist lesen, Cover laden, Collage erstellen.')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='mehr Ausgaben (-v: jede Kachel und jeder Download)')
+    parser.add_argument('--metrics', metavar='DATEI',
+                        help='Zeiten und Zähler speichern (.json oder .prom)')
+    commands = parser.add_subparsers(dest='command', metavar='BEFEHL')
+
+    run = commands.add_parser('run', help='kompletter Ablauf für eine Playlist (Standard)')
+    run.add_argument('--playlist', help='Name der Playlist (sonst PLAYLIST_NAME)')
+    run.add_argument('--output', default='album_collage.jpg', help='Ausgabedatei')
+    run.add_argument('-y', '--yes', action='store_true', help='ohne Rückfrage fortfahren')
+    run.add_argument('--fresh', action='store_true',
+                     help='Stand eines abgebrochenen Laufs verwerfen und neu beginnen')
+    run.set_defaults(handler=run_workflow)
+
+    fetch = commands.add_parser('fetch', help='nur die Playlist lesen (albums.jsonl, musik.txt)')
+    fetch.add_argument('--playlist', help='Name der Playlist (sonst PLAYLIST_NAME)')
+    fetch.set_defaults(handler=run_fetch)
+
+    download = commands.add_parser('download', help='nur die Cover herunterladen')
+    download.add_argument('--fresh', action='store_true',
+                          help='Stand eines abgebrochenen Laufs verwerfen')
+    download.set_defaults(handler=run_download)
+
+    for name, handler, description in (
+            ('collage', run_collage, 'Collage aus den gespeicherten Covern erstellen'),
+            ('plan', run_plan, 'nur das Layout berechnen (Dry-Run, ohne Rendern)')):
+        command = commands.add_parser(name, help=description)
+        command.add_argument('--photos', default='photos', help='Cover-Ordner')
+        command.add_argument('--seed', type=int, help='Seed für ein reproduzierbares Layout')
+        command.add_argument('--order', choices=('random', 'brightness', 'hue', 'spread'),
+                             help='Anordnung der Cover')
+        command.set_defaults(handler=handler)
+        if name == 'collage':
+            command.add_argument('--output', default='album_collage.jpg', help='Ausgabedatei')
+            command.add_argument('--band-height', type=int,
+                                 help='streifenweise als PNG rendern (Streifenhöhe in px)')
+            command.add_argument('--format', choices=('jpeg', 'webp', 'avif', 'png'),
+                                 help='Bildformat (sonst nach Dateiendung)')
+            command.add_argument('--quality', type=quality_value, help='Qualität 1-100 (sonst COLLAGE_QUALITY)')
+            command.add_argument('--max-kb', type=size_kb,
+                                 help='Dateigröße begrenzen, die Qualität wird angepasst')
+        else:
+            command.add_argument('--width', type=int, help='Breite (sonst COLLAGE_WIDTH)')
+            command.add_argument('--height', type=int, help='Höhe (sonst COLLAGE_HEIGHT)')
+            command.add_argument('--save', metavar='DATEI', help='Plan als JSON speichern')
+
+    variants = commands.add_parser('variants', help='mehrere Formate/Seeds aus denselben Covern')
+    variants.add_argument('specs', nargs='*', metavar='VARIANTE',
+                          help='z. B. phone, tablet@7, 2000x3000@1=poster.jpg')
+    variants.set_defaults(handler=run_variants)
+
+    batch = commands.add_parser('batch', help='mehrere Playlists und Accounts auf einmal')
+    batch.add_argument('jobs', nargs='*', metavar='PLAYLIST', help='Playlist oder user:Playlist')
+    batch.set_defaults(handler=run_batch)
+
+    serve = commands.add_parser('serve', help='Render-Server starten')
+    serve.add_argument('--host', help='Adresse (sonst RENDER_HOST)')
+    serve.add_argument('--port', type=int, help='Port (sonst RENDER_PORT)')
+    serve.set_defaults(handler=run_serve)
+
+    cache = commands.add_parser('cache', help='Such-Cache und Cover-Ordner anzeigen')
+    cache.add_argument('--clear', action='store_true', help='Such-Cache leeren')
+    cache.add_argument('--clear-misses', action='store_true',
+                       help='nur Suchen ohne Treffer vergessen')
+    cache.set_defaults(handler=run_cache)
+    return parser
+
+def main(argv=None):
+    """Parse the command line and run the chosen subcommand"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    # Settings the modules read when they are imported
+    if args.verbose:
+        os.environ['COVERMIX_VERBOSITY'] = str(1 + args.verbose)
+    if args.metrics:
+        os.environ['METRICS_OUTPUT'] = args.metrics
+    if args.command is None:
+        args = parser.parse_args((argv if argv is not None else sys.argv[1:]) + ['run'])
+    if (args.command == 'collage' and args.band_height
+            and ((args.format or 'png') != 'png' or args.quality or args.max_kb)):
+        parser.error("--band-height schreibt PNG; --format, --quality und --max-kb passen nicht dazu")
+    args.handler(args)
 
 if __name__ == "__main__":
     try:
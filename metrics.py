@@ -0,0 +1,111 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# 0 = errors only, 1 = progress (default), 2 = every single tile
+VERBOSITY = int(os.getenv('COVERMIX_VERBOSITY', 1))
+
+def verbose(level):
+    """True when messages of the given level should be printed"""
+    return VERBOSITY >= level
+
+class Metrics:
+    """Thread-safe counters and timing spans, exportable as JSON or Prometheus text"""
+
+    def __init__(self, prefix='covermix'):
+        self.prefix = prefix
+        self.counters = {}
+        self.spans = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        """Record one span of the given duration"""
+        with self.lock:
+            count, total, longest = self.spans.get(name, (0, 0.0, 0.0))
+            self.spans[name] = (count + 1, total + seconds, max(longest, seconds))
+
+    @contextmanager
+    def span(self, name):
+        """Time the enclosed block, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.spans.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        """Plain dict of all counters and spans"""
+        with self.lock:
+            return {
+                'started': self.started,
+                'counters': dict(sorted(self.counters.items())),
+                'spans': {
+                    name: {'count': count, 'seconds': total, 'max_seconds': longest}
+                    for name, (count, total, longest) in sorted(self.spans.items())
+                },
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """Prometheus text exposition format: counters and span summaries"""
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in snapshot['counters'].items():
+            metric = f"{self.prefix}_{metric_name(name)}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, span in snapshot['spans'].items():
+            metric = f"{self.prefix}_{metric_name(name)}_seconds"
+            lines += [f"# TYPE {metric} summary",
+                      f"{metric}_sum {span['seconds']:.6f}",
+                      f"{metric}_count {span['count']}",
+                      f"# TYPE {metric}_max gauge",
+                      f"{metric}_max {span['max_seconds']:.6f}"]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write to path, as Prometheus text for .prom/.txt and JSON otherwise"""
+        if path.endswith(('.prom', '.txt')):
+            data = self.to_prometheus()
+        else:
+            data = self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        return path
+
+def metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+# Process-wide registry used by all stages
+metrics = Metrics()
+
+def incr(name, value=1):
+    metrics.incr(name, value)
+
+def observe(name, seconds):
+    metrics.observe(name, seconds)
+
+def span(name):
+    return metrics.span(name)
+
+def write_metrics(path=None):
+    """Export the metrics to path or METRICS_OUTPUT; returns the path written, if any"""
+    path = path or os.getenv('METRICS_OUTPUT')
+    if not path:
+        return None
+    return metrics.write(path)
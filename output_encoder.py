@@ -0,0 +1,154 @@
+"""
+Collage output encoding
+=======================
+
+Turns a rendered canvas into image bytes. The format follows the output
+file's extension (.jpg, .webp, .avif, .png) unless COLLAGE_OUTPUT_FORMAT
+names one:
+
+- JPEG is written with optimized Huffman tables and progressive scans;
+  that is smaller at the same quality and shows a preview while loading.
+- WebP and AVIF are available where this Pillow build supports them
+  (python -m PIL.report lists the modules).
+- PNG is lossless; quality and byte budget do not apply.
+
+COLLAGE_QUALITY (default 95) sets the quality. With a byte budget
+(COLLAGE_MAX_KB) the quality is binary-searched for the highest one whose
+output still fits. A canvas that does not fit even at MIN_QUALITY is
+written at MIN_QUALITY.
+
+BackgroundEncoder encodes and writes on its own thread, so a batch can
+composite the next variant while the previous one is being compressed.
+"""
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import features
+
+from metrics import incr, span
+
+# Pillow format, file extension and MIME type per output format
+FORMATS = {
+    'jpeg': ('JPEG', '.jpg', 'image/jpeg'),
+    'webp': ('WEBP', '.webp', 'image/webp'),
+    'avif': ('AVIF', '.avif', 'image/avif'),
+    'png': ('PNG', '.png', 'image/png'),
+}
+EXTENSIONS = {'.jpg': 'jpeg', '.jpeg': 'jpeg', '.webp': 'webp', '.avif': 'avif', '.png': 'png'}
+
+QUALITY = int(os.getenv('COLLAGE_QUALITY', 95))
+MAX_BYTES = int(float(os.getenv('COLLAGE_MAX_KB', 0)) * 1024)
+MIN_QUALITY = 20
+# WebP method 0-6 and AVIF speed 0-10 trade encode time for size; AVIF at its
+# default speed 6 takes seconds for a phone-sized canvas
+WEBP_METHOD = 4
+AVIF_SPEED = 8
+
+def supported(fmt):
+    """Whether this Pillow build can write the format"""
+    if fmt in ('jpeg', 'png'):
+        return True
+    # Older Pillow versions do not know the avif module at all
+    return fmt in features.modules and features.check_module(fmt)
+
+def resolve_format(path=None, fmt=None):
+    """Output format for path: fmt, else COLLAGE_OUTPUT_FORMAT, else the extension (JPEG by default)"""
+    extension = os.path.splitext(path or '')[1].lower()
+    fmt = (fmt or os.getenv('COLLAGE_OUTPUT_FORMAT') or EXTENSIONS.get(extension, 'jpeg')).lower()
+    fmt = EXTENSIONS.get('.' + fmt, fmt)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unbekanntes Ausgabeformat: {fmt} (möglich: {', '.join(FORMATS)})")
+    if not supported(fmt):
+        raise ValueError(f"Pillow unterstützt {fmt.upper()} hier nicht")
+    return fmt
+
+def output_path(path, fmt):
+    """path with the extension of fmt, unless it already has a matching one"""
+    root, extension = os.path.splitext(path)
+    if EXTENSIONS.get(extension.lower()) == fmt:
+        return path
+    return root + FORMATS[fmt][1]
+
+def mime_type(fmt):
+    return FORMATS[fmt][2]
+
+def save_options(fmt, quality):
+    if fmt == 'jpeg':
+        return {'quality': quality, 'optimize': True, 'progressive': True}
+    if fmt == 'webp':
+        return {'quality': quality, 'method': WEBP_METHOD}
+    if fmt == 'avif':
+        return {'quality': quality, 'speed': AVIF_SPEED}
+    return {}
+
+def encode_at(img, fmt, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, FORMATS[fmt][0], **save_options(fmt, quality))
+    return buffer.getvalue()
+
+def encode_image(img, fmt='jpeg', quality=None, max_bytes=None):
+    """Encode img, returning (bytes, quality used)
+
+    With max_bytes (COLLAGE_MAX_KB by default) lossy formats take the
+    highest quality up to quality whose output fits; file size grows with
+    quality, so a binary search needs about log2(quality - MIN_QUALITY) encodes.
+    """
+    quality = QUALITY if quality is None else quality
+    if not 1 <= quality <= 100:
+        raise ValueError(f"Qualität muss zwischen 1 und 100 liegen: {quality}")
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    with span('encode'):
+        data = encode_at(img, fmt, quality)
+        if max_bytes and fmt != 'png' and len(data) > max_bytes:
+            best, smallest = None, (data, quality)
+            low, high = MIN_QUALITY, quality - 1
+            while low <= high:
+                middle = (low + high) // 2
+                candidate = encode_at(img, fmt, middle)
+                incr('encode_budget_attempts')
+                if len(candidate) <= max_bytes:
+                    best, low = (candidate, middle), middle + 1
+                else:
+                    smallest, high = (candidate, middle), middle - 1
+            if best is None:
+                incr('encode_budget_missed')
+                best = smallest
+            data, quality = best
+    incr('output_bytes', len(data))
+    return data, quality
+
+def save_image(img, path, fmt=None, quality=None, max_bytes=None):
+    """Encode img into path, returning (path, quality, bytes)
+
+    The extension of path is adjusted to the format, e.g. collage.jpg
+    becomes collage.webp with COLLAGE_OUTPUT_FORMAT=webp.
+    """
+    fmt = resolve_format(path, fmt)
+    path = output_path(path, fmt)
+    data, quality = encode_image(img, fmt, quality, max_bytes)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path, quality, len(data)
+
+def describe_output(quality, size):
+    return f"Qualität {quality}, {size / 1024:.0f} KB"
+
+class BackgroundEncoder:
+    """Encode and write images on a separate thread, returning futures of save_image"""
+
+    def __init__(self, workers=1):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='encode')
+
+    def submit(self, img, path, fmt=None, quality=None, max_bytes=None):
+        return self.executor.submit(save_image, img, path, fmt, quality, max_bytes)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,253 @@
+"""
+In-process pipeline: fetch -> download -> compose
+=================================================
+
+The three stages run as threads connected by bounded queues. Albums are
+handed to the download workers while later playlist pages are still being
+fetched, and finished covers are decoded into the shared image cache by the
+compose stage while other downloads are still running. The collage layout needs the final cover count,
+so placing and saving starts as soon as the last cover has arrived. A stage
+that fails cancels the others, so none of them stays blocked on a queue
+nobody drains any more.
+
+With a run state (run_state.py) every stage checkpoints its progress: a
+resumed run replays the saved playlist pages and continues at the next one,
+skips covers stored before, and renders the saved plan from the last saved
+canvas on.
+"""
+
+import os
+import queue
+import threading
+import time
+
+import collage_maker
+import cover_downloader
+import playlist_analyzer
+from album_manifest import album_label
+from collage_layout import max_tile_size
+from cover_features import get_index
+from cover_store import CoverStore, pick_variant
+from image_cache import DecodedImageCache
+from metrics import observe, verbose
+from run_state import RunState
+
+QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 64))
+# How often a stage blocked on a queue checks whether the run was cancelled
+POLL_SECONDS = 0.1
+
+# Marks the end of a queue
+_DONE = object()
+
+class Cancelled(Exception):
+    """Raised inside a stage once another stage has failed"""
+
+class Pipeline:
+    """Run the fetch, download and compose stages of one playlist in-process"""
+
+    def __init__(self, playlist_name, output_path='album_collage.jpg', workers=None,
+                 store=None, log=print, state=None):
+        self.playlist_name = playlist_name
+        self.output_path = output_path
+        self.workers = workers or cover_downloader.concurrency
+        self.store = store or CoverStore()
+        self.log = log
+        self.state = state
+
+        self.albums = queue.Queue(maxsize=QUEUE_SIZE)
+        self.covers = queue.Queue(maxsize=QUEUE_SIZE)
+        self.records = []
+        self.cover_paths = []
+        self.failed = []
+        self.errors = []
+        self.timings = {}
+        self.result = None
+        self.lock = threading.Lock()
+        self.fetch_done = threading.Event()
+        self.cancelled = threading.Event()
+        self.workers_left = self.workers
+
+    def run_stage(self, name, target, *args):
+        """Run a stage function, recording its duration and any error"""
+        start = time.perf_counter()
+        try:
+            target(*args)
+        except Cancelled:
+            pass
+        except Exception as e:
+            with self.lock:
+                self.errors.append((name, e))
+            self.log(f"❌ [{name}] {e}")
+            # Nobody may be left to drain or fill the queues: stop the other stages
+            self.cancelled.set()
+        finally:
+            seconds = time.perf_counter() - start
+            observe(f'stage_{name}', seconds)
+            with self.lock:
+                self.timings[name] = max(self.timings.get(name, 0), seconds)
+
+    def put(self, target, item):
+        """Put item on a bounded queue, giving up once the run is cancelled"""
+        while True:
+            if self.cancelled.is_set():
+                raise Cancelled()
+            try:
+                target.put(item, timeout=POLL_SECONDS)
+                return
+            except queue.Full:
+                pass
+
+    def get(self, source):
+        """Take the next item from a queue, giving up once the run is cancelled"""
+        while True:
+            if self.cancelled.is_set():
+                raise Cancelled()
+            try:
+                return source.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                pass
+
+    def add_records(self, records):
+        for record in records:
+            self.records.append(record)
+            self.put(self.albums, record)
+            if len(self.records) % 100 == 0:
+                self.log(f"📃 [fetch] {len(self.records)} Alben gelesen")
+
+    def fetch(self):
+        try:
+            start_url, complete = None, False
+            if self.state:
+                records, start_url, complete = self.state.fetch_position()
+                if records:
+                    self.log(f"↻ [fetch] {len(records)} Alben aus dem letzten Lauf")
+                self.add_records(records)
+            if not complete:
+                seen = {playlist_analyzer.album_key(record) for record in self.records}
+                pages = playlist_analyzer.iter_album_pages(self.playlist_name, start_url=start_url,
+                                                           seen=seen)
+                for records, next_url in pages:
+                    if self.state:
+                        self.state.add_page(records, next_url)
+                    self.add_records(records)
+        finally:
+            self.fetch_done.set()
+            self.put(self.albums, _DONE)
+
+        count = playlist_analyzer.write_album_lists(self.records, self.playlist_name)
+        self.log(f"📃 [fetch] {count} Alben in musik.txt gespeichert")
+
+    def download(self):
+        try:
+            while True:
+                record = self.get(self.albums)
+                if record is _DONE:
+                    # Let the other workers see the end marker too
+                    self.put(self.albums, _DONE)
+                    break
+                key = playlist_analyzer.album_key(record)
+                stored, path = self.state.cover(key) if self.state else (False, None)
+                if stored and path and os.path.exists(path):
+                    message = f"↻ Cover aus dem letzten Lauf: {path}"
+                else:
+                    path, message = cover_downloader.store_album(record, self.store)
+                    if path and self.state:
+                        self.state.add_cover(key, path)
+                if path is None or verbose(2):
+                    self.log(f"⬇️  [download] {message}")
+                if path:
+                    self.put(self.covers, path)
+                else:
+                    with self.lock:
+                        self.failed.append(album_label(record))
+        finally:
+            with self.lock:
+                self.workers_left -= 1
+                last = self.workers_left == 0
+            if last:
+                self.store.flush()
+                self.put(self.covers, _DONE)
+
+    def tile_size_hint(self):
+        if not self.fetch_done.is_set() or not self.records:
+            return None
+        size = max_tile_size(len(self.records), *collage_maker.canvas_size())
+        return (size, size)
+
+    def compose(self):
+        cache = DecodedImageCache()
+        # Features are taken from the decoded covers as they arrive, so a
+        # colour order later needs no extra decode
+        features = get_index(self.store.root)
+        seen = set()
+        while True:
+            path = self.get(self.covers)
+            if path is _DONE:
+                break
+            # Different records can resolve to the same stored cover
+            if path in seen:
+                continue
+            seen.add(path)
+            try:
+                # Decode while downloads continue; the LRU budget bounds memory.
+                # Once the album count is known, JPEGs are draft-decoded at the
+                # largest size the layout can use.
+                hint = self.tile_size_hint()
+                # Warm the stored size the renderer will pick for this cover
+                source = pick_variant(path, hint[0]) if hint else path
+                levels = cache.levels(source, hint)
+                features.add(path, levels[-1])
+            except Exception as e:
+                self.log(f"✗ [compose] Cover nicht lesbar: {path} ({e})")
+                continue
+            self.cover_paths.append(path)
+
+        features.flush()
+        if not self.cover_paths:
+            self.log("❌ [compose] Keine Cover für die Collage vorhanden")
+            return
+        self.log(f"🎨 [compose] Erstelle Collage aus {len(self.cover_paths)} Covern...")
+        self.result = collage_maker.create_collage(self.cover_paths, self.output_path, cache=cache,
+                                                   state=self.state)
+
+    def run(self):
+        """Run all stages and return a summary dict"""
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self.run_stage, args=('fetch', self.fetch), daemon=True)]
+        threads += [
+            threading.Thread(target=self.run_stage, args=('download', self.download), daemon=True)
+            for _ in range(self.workers)
+        ]
+        threads.append(threading.Thread(target=self.run_stage, args=('compose', self.compose), daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.timings['total'] = time.perf_counter() - start
+
+        if self.state:
+            if self.errors or not self.result or self.failed:
+                # Keep the checkpoints; a rerun retries only what is missing
+                self.state.close()
+            else:
+                self.state.finish()
+        return {
+            'albums': len(self.records),
+            'covers': len(self.cover_paths),
+            'failed': sorted(self.failed),
+            'errors': self.errors,
+            'output': self.result,
+            'timings': self.timings,
+        }
+
+def run_pipeline(playlist_name=None, output_path='album_collage.jpg', resume=False, fresh=False,
+                 **kwargs):
+    """Convenience wrapper running the complete workflow for one playlist
+
+    resume checkpoints the run and continues an unfinished earlier run of
+    the same playlist and output; fresh discards such a run first.
+    """
+    playlist_name = playlist_name or playlist_analyzer.playlist_name
+    if resume:
+        kwargs['state'] = RunState({'playlist': playlist_name, 'output': output_path}, fresh=fresh)
+    return Pipeline(playlist_name, output_path, **kwargs).run()
@@ -1,9 +1,10 @@
-import requests
-import json
-
 import os
 from dotenv import load_dotenv
 
+from album_manifest import album_label, album_record, manifest_path, write_manifest
+from metrics import write_metrics
+from spotify_client import SpotifyAPIError, get_client
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -11,58 +12,121 @@ load_dotenv()
 token = os.getenv('SPOTIFY_TOKEN')
 playlist_name = os.getenv('PLAYLIST_NAME', 'Lieblingssongs')
 
-if not token:
-    print("❌ SPOTIFY_TOKEN nicht in .env gefunden!")
-    print("Bitte konfiguriere deine .env Datei mit:")
-    print("SPOTIFY_TOKEN=dein_token_hier")
-    exit(1)
-
-def fetch_web_api(endpoint, method, body=None):
-    url = f"https://api.spotify.com/{endpoint}"
-    headers = {
-        'Authorization': f'Bearer {token}'
-    }
-    
-    if method == 'GET':
-        response = requests.get(url, headers=headers)
-    elif method == 'POST':
-        headers['Content-Type'] = 'application/json'
-        response = requests.post(url, headers=headers, data=json.dumps(body) if body else None)
-    
-    return response.json()
-
-def get_playlist_tracks(playlist_name):
-    # Get user's playlists
-    playlists = fetch_web_api('v1/me/playlists', 'GET')
-    
-    # Find the "Lieblingssongs" playlist
-    target_playlist = None
-    for playlist in playlists['items']:
-        if playlist['name'].lower() == playlist_name.lower():
-            target_playlist = playlist
+# Only request the parts of each playlist item we actually use
+TRACK_FIELDS = 'next,items(track(album(id,name,artists(name),images)))'
+
+def iter_page_objects(endpoint, params=None, client=None):
+    """Yield each page of a paged endpoint, following the 'next' links"""
+    client = client or get_client()
+    page = client.fetch_web_api(endpoint, 'GET', params=params)
+    while page:
+        yield page
+        next_url = page.get('next')
+        if not next_url:
             break
-    
+        # The next link already carries limit, offset and fields
+        page = client.fetch_web_api(next_url, 'GET')
+
+def iter_pages(endpoint, params=None, client=None):
+    """Yield the items of a paged endpoint, following the 'next' links"""
+    for page in iter_page_objects(endpoint, params, client):
+        yield from page.get('items', [])
+
+def find_playlist(playlist_name, client=None):
+    """Return the user's playlist with the given name, or None"""
+    for playlist in iter_pages('v1/me/playlists', params={'limit': 50}, client=client):
+        if playlist and playlist['name'].lower() == playlist_name.lower():
+            return playlist
+    return None
+
+def get_playlist_tracks(playlist_name, client=None):
+    """Yield the tracks of a playlist page by page
+
+    client selects the account (token) to read from, the shared default
+    client otherwise.
+    """
+    target_playlist = find_playlist(playlist_name, client)
+
     if not target_playlist:
         print(f"Playlist '{playlist_name}' nicht gefunden!")
-        return []
-    
-    # Get tracks from the playlist
+        return
+
     playlist_id = target_playlist['id']
-    result = fetch_web_api(f'v1/playlists/{playlist_id}/tracks', 'GET')
-    return [item['track'] for item in result.get('items', []) if item['track']]
+    params = {'limit': 100, 'fields': TRACK_FIELDS}
+    for item in iter_pages(f'v1/playlists/{playlist_id}/tracks', params=params, client=client):
+        if item.get('track'):
+            yield item['track']
+
+def album_key(record):
+    """Identity of an album; local files have no album ID, so fall back to the label"""
+    return record['id'] or album_label(record)
+
+def page_albums(page, seen):
+    """Album records of a playlist page that are not in seen yet (seen is updated)"""
+    records = []
+    for item in page.get('items', []):
+        album = (item.get('track') or {}).get('album') or {}
+        if not album.get('name') or not album.get('artists'):
+            continue
+        record = album_record(album)
+        key = album_key(record)
+        if key not in seen:
+            seen.add(key)
+            records.append(record)
+    return records
+
+def iter_album_pages(playlist_name, client=None, start_url=None, seen=None):
+    """Yield (new album records, next page URL) for each playlist page
+
+    start_url continues an earlier run at that page instead of looking the
+    playlist up again; seen holds the album keys that run already yielded.
+    The next URL is None on the last page.
+    """
+    seen = set() if seen is None else seen
+    if start_url:
+        pages = iter_page_objects(start_url, client=client)
+    else:
+        target_playlist = find_playlist(playlist_name, client)
+        if not target_playlist:
+            print(f"Playlist '{playlist_name}' nicht gefunden!")
+            return
+        params = {'limit': 100, 'fields': TRACK_FIELDS}
+        pages = iter_page_objects(f"v1/playlists/{target_playlist['id']}/tracks", params, client)
+    for page in pages:
+        yield page_albums(page, seen), page.get('next')
+
+def iter_playlist_albums(playlist_name, client=None):
+    """Yield each distinct album record as soon as its page arrives"""
+    for records, _ in iter_album_pages(playlist_name, client):
+        yield from records
+
+def write_album_lists(records, playlist_name, manifest=None, listing='musik.txt'):
+    """Write the manifest and the human readable musik.txt, returning the album count"""
+    write_manifest(manifest or manifest_path(), records)
 
-playlist_tracks = get_playlist_tracks(playlist_name)
-albums = set()
+    albums = sorted({album_label(record) for record in records})
+    with open(listing, 'w', encoding='utf-8') as f:
+        f.write(f"Alben aus der Playlist '{playlist_name}':\n")
+        for album in albums:
+            f.write(f"- {album}\n")
+    return len(albums)
 
-for track in playlist_tracks:
-    album_name = track['album']['name']
-    artist_name = track['album']['artists'][0]['name']  # First artist
-    album_with_artist = f"{album_name} - {artist_name}"
-    albums.add(album_with_artist)
+def main(name=None):
+    if not token:
+        print("❌ SPOTIFY_TOKEN nicht in .env gefunden!")
+        print("Bitte konfiguriere deine .env Datei mit:")
+        print("SPOTIFY_TOKEN=dein_token_hier")
+        exit(1)
 
-with open('musik.txt', 'w', encoding='utf-8') as f:
-    f.write(f"Alben aus der Playlist '{playlist_name}':\n")
-    for album in sorted(albums):
-        f.write(f"- {album}\n")
+    name = name or playlist_name
+    try:
+        records = list(iter_playlist_albums(name))
+    except SpotifyAPIError as e:
+        print(f"❌ Spotify-API-Fehler beim Lesen der Playlist '{name}': {e}")
+        exit(1)
+    count = write_album_lists(records, name)
+    print(f"{count} Alben wurden in musik.txt und {manifest_path()} gespeichert!")
+    write_metrics()
 
-print("Alben wurden in musik.txt gespeichert!")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Batch mode: collages for many playlists and accounts in one run
+===============================================================
+
+All playlists are read concurrently. Albums are deduplicated across every
+playlist as they arrive, so each unique cover is downloaded once even when
+many playlists share it. Every playlist still gets its own album manifest,
+musik.txt and collage in its own folder, and the collages share one decoded
+image cache.
+
+    python playlist_batch.py Lieblingssongs anna:Sommer anna:Roadtrip
+
+A job is 'Playlist' for the default SPOTIFY_TOKEN or 'user:Playlist' for the
+token in SPOTIFY_TOKEN_<USER>. The prefix only counts as a user when that
+token is set, so 'Mix: 2024' stays a playlist name. Without arguments the
+jobs come from PLAYLIST_NAMES (separated by ';').
+"""
+
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import collage_maker
+import cover_downloader
+import playlist_analyzer
+from album_manifest import DEFAULT_PATH, album_label
+from cover_store import CoverStore
+from image_cache import DecodedImageCache
+from metrics import verbose, write_metrics
+from spotify_client import SpotifyClient, get_client
+
+load_dotenv()
+
+OUTPUT_DIR = os.getenv('BATCH_OUTPUT_DIR', 'playlists')
+FETCH_CONCURRENCY = max(1, int(os.getenv('BATCH_FETCH_CONCURRENCY', 4)))
+
+def token_variable(user):
+    return f"SPOTIFY_TOKEN_{user.upper()}"
+
+def parse_job(text):
+    """Split 'user:Playlist' into (user, playlist); user is None for the default token
+
+    Only a prefix with a configured SPOTIFY_TOKEN_<USER> is a user, anything
+    else is part of the playlist name.
+    """
+    if ':' in text:
+        user, playlist = (part.strip() for part in text.split(':', 1))
+        if user and playlist and os.getenv(token_variable(user)):
+            return user, playlist
+    return None, text.strip()
+
+def job_folder(user, playlist, root=None):
+    """Output folder of one job, e.g. playlists/anna-sommer-a74280
+
+    The slug alone is ambiguous ('a b' and 'a_b', user 'anna' with 'x' and
+    playlist 'anna-x'), so a short hash of the exact job is appended.
+    """
+    name = f"{user}-{playlist}" if user else playlist
+    slug = re.sub(r'[^\w-]+', '_', name.lower()).strip('_') or 'playlist'
+    digest = hashlib.sha1(repr((user, playlist)).encode('utf-8')).hexdigest()[:6]
+    return os.path.join(root or OUTPUT_DIR, f"{slug}-{digest}")
+
+class PlaylistBatch:
+    """Fetch many playlists, download their covers once and render one collage each"""
+
+    def __init__(self, jobs, store=None, workers=None, output_dir=None, log=print):
+        self.jobs = [{'user': user, 'playlist': playlist, 'records': [], 'error': None,
+                      'folder': job_folder(user, playlist, output_dir)}
+                     for user, playlist in jobs]
+        self.store = store or CoverStore()
+        self.workers = workers or cover_downloader.concurrency
+        self.log = log
+        self.clients = {}
+        self.downloads = {}
+        self.lock = threading.Lock()
+
+    def client_for(self, user):
+        """One client per account; each keeps its own token and rate limit"""
+        if user is None:
+            return get_client()
+        with self.lock:
+            if user not in self.clients:
+                token = os.getenv(token_variable(user))
+                if not token:
+                    raise ValueError(f"{token_variable(user)} nicht gesetzt")
+                self.clients[user] = SpotifyClient(token=token)
+            return self.clients[user]
+
+    def fetch(self, job, executor):
+        """Read one playlist, queueing each album not seen in any playlist yet"""
+        try:
+            client = self.client_for(job['user'])
+            for record in playlist_analyzer.iter_playlist_albums(job['playlist'], client):
+                job['records'].append(record)
+                key = playlist_analyzer.album_key(record)
+                with self.lock:
+                    if key not in self.downloads:
+                        self.downloads[key] = executor.submit(
+                            cover_downloader.store_album, record, self.store)
+        except Exception as e:
+            job['error'] = e
+            self.log(f"❌ [{job['playlist']}] {e}")
+            return
+        if not job['records']:
+            job['error'] = "Keine Alben gefunden"
+            return
+        os.makedirs(job['folder'], exist_ok=True)
+        playlist_analyzer.write_album_lists(
+            job['records'], job['playlist'],
+            manifest=os.path.join(job['folder'], DEFAULT_PATH),
+            listing=os.path.join(job['folder'], 'musik.txt'))
+        self.log(f"📃 [{job['playlist']}] {len(job['records'])} Alben")
+
+    def cover_paths(self, job):
+        """Stored covers of one playlist, in playlist order and without duplicates"""
+        paths, failed = [], []
+        for record in job['records']:
+            path, _ = self.downloads[playlist_analyzer.album_key(record)].result()
+            if path is None:
+                failed.append(album_label(record))
+            elif path not in paths:
+                paths.append(path)
+        return paths, failed
+
+    def run(self):
+        """Run the batch and return a summary dict with one entry per job"""
+        start = time.perf_counter()
+        timings = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as downloads:
+            with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as fetchers:
+                list(fetchers.map(lambda job: self.fetch(job, downloads), self.jobs))
+            timings['fetch'] = time.perf_counter() - start
+            for future in list(self.downloads.values()):
+                path, message = future.result()
+                if path is None or verbose(2):
+                    self.log(f"⬇️  {message}")
+        self.store.flush()
+        timings['download'] = time.perf_counter() - start
+
+        # Playlists that share albums also share their decoded covers
+        cache = DecodedImageCache()
+        results = []
+        for job in self.jobs:
+            result = {'user': job['user'], 'playlist': job['playlist'], 'folder': job['folder'],
+                      'albums': len(job['records']), 'covers': 0, 'failed': [],
+                      'output': None, 'error': job['error']}
+            results.append(result)
+            if job['error']:
+                continue
+            paths, result['failed'] = self.cover_paths(job)
+            result['covers'] = len(paths)
+            if not paths:
+                self.log(f"❌ [{job['playlist']}] Keine Cover für die Collage vorhanden")
+                continue
+            output = os.path.join(job['folder'], 'album_collage.jpg')
+            result['output'] = collage_maker.create_collage(paths, output, cache=cache)
+        timings['compose'] = time.perf_counter() - start - timings['download']
+        timings['total'] = time.perf_counter() - start
+
+        return {
+            'jobs': results,
+            'unique_albums': len(self.downloads),
+            'albums': sum(len(job['records']) for job in self.jobs),
+            'timings': timings,
+        }
+
+def run_batch(jobs, **kwargs):
+    """Run the batch for a list of (user, playlist) pairs"""
+    return PlaylistBatch(jobs, **kwargs).run()
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    if not args:
+        names = os.getenv('PLAYLIST_NAMES') or playlist_analyzer.playlist_name
+        args = [name for name in names.split(';') if name.strip()]
+    summary = run_batch([parse_job(arg) for arg in args])
+
+    print()
+    for job in summary['jobs']:
+        label = f"{job['user']}:{job['playlist']}" if job['user'] else job['playlist']
+        if job['error']:
+            print(f"❌ {label}: {job['error']}")
+        else:
+            print(f"🎨 {label}: {job['covers']}/{job['albums']} Cover → {job['output']}")
+    print(f"💿 {summary['unique_albums']} verschiedene Alben für {summary['albums']} Playlist-Einträge")
+    print("⏱️  " + ", ".join(f"{stage}: {seconds:.1f}s" for stage, seconds in summary['timings'].items()))
+    write_metrics()
+    if any(job['error'] or not job['output'] for job in summary['jobs']):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import os
+import struct
+import zlib
+
+from cover_store import temp_file
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Flush compressed data into an IDAT chunk once this much has accumulated
+IDAT_SIZE = 1 << 20
+
+def png_chunk(kind, data):
+    body = kind + data
+    return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body) & 0xffffffff)
+
+class PNGStreamWriter:
+    """Write an 8-bit RGB PNG row band by row band
+
+    Pillow needs the whole image in memory to encode it; this writer only
+    ever holds one band plus the zlib window. The file is written to a
+    temporary name and renamed when all rows have arrived.
+    """
+
+    def __init__(self, f, width, height, level=6):
+        self.f = f
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self.compressor = zlib.compressobj(level)
+        self.pending = []
+        self.pending_size = 0
+        f.write(PNG_SIGNATURE)
+        # Width, height, bit depth 8, colour type 2 (RGB), deflate, no interlace
+        f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+
+    @classmethod
+    def open(cls, path, width, height, level=6):
+        return _AtomicPNG(path, width, height, level)
+
+    def write_rows(self, band):
+        """Append an RGB image of the full width below the rows written so far"""
+        if band.mode != 'RGB':
+            band = band.convert('RGB')
+        if band.width != self.width:
+            raise ValueError(f"Streifenbreite {band.width} passt nicht zu {self.width}")
+        if self.rows + band.height > self.height:
+            raise ValueError("Mehr Zeilen als die Bildhöhe")
+        data = band.tobytes()
+        stride = self.width * 3
+        # Filter type 0 (None) in front of every scanline
+        raw = b''.join(b'\x00' + data[i:i + stride] for i in range(0, len(data), stride))
+        self.feed(self.compressor.compress(raw))
+        self.rows += band.height
+
+    def feed(self, data):
+        if not data:
+            return
+        self.pending.append(data)
+        self.pending_size += len(data)
+        if self.pending_size >= IDAT_SIZE:
+            self.flush_idat()
+
+    def flush_idat(self):
+        if self.pending:
+            self.f.write(png_chunk(b'IDAT', b''.join(self.pending)))
+            self.pending = []
+            self.pending_size = 0
+
+    def close(self):
+        if self.rows != self.height:
+            raise ValueError(f"Nur {self.rows} von {self.height} Zeilen geschrieben")
+        self.feed(self.compressor.flush())
+        self.flush_idat()
+        self.f.write(png_chunk(b'IEND', b''))
+
+class _AtomicPNG:
+    """Context manager around PNGStreamWriter that replaces path on success"""
+
+    def __init__(self, path, width, height, level):
+        self.path = path
+        self.args = (width, height, level)
+
+    def __enter__(self):
+        folder = os.path.dirname(self.path) or '.'
+        fd, self.tmp_path = temp_file(folder)
+        self.f = os.fdopen(fd, 'wb')
+        self.writer = PNGStreamWriter(self.f, *self.args)
+        return self.writer
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            try:
+                if exc_type is None:
+                    self.writer.close()
+            finally:
+                self.f.close()
+            if exc_type is None:
+                os.replace(self.tmp_path, self.path)
+        finally:
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+        return False
@@ -0,0 +1,385 @@
+"""
+Collage render server
+=====================
+
+Long-running HTTP service that keeps the cover store, the decoded image
+cache and the cover feature index warm between requests.
+
+    POST /render  {"playlist": "Lieblingssongs", "width": 1080, "height": 1920,
+                   "seed": 7, "style": {"order": "hue"}}
+    POST /render  {"covers": ["<Album-ID>", "photos/other.jpg"], "seed": 7,
+                   "format": "webp", "quality": 80, "max_kb": 300}
+    GET  /stats
+
+The response is the image itself, JPEG unless "format" asks for webp, avif
+or png (see output_encoder.py); "max_kb" caps its size. X-Plan-Hash and
+X-Cache (hit, miss or coalesced) tell how it was produced. Identical requests that arrive while a
+render is running wait for that render instead of starting their own, and
+repeats are answered from an in-memory output cache keyed by the placement
+plan hash and the encoding. Requests seen before skip even the layout pass: their resolved
+parameters map straight to the plan hash.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+import collage_maker
+import cover_downloader
+import playlist_analyzer
+from collage_layout import plan_hash, plan_layout, resolve_style
+from cover_store import CoverStore
+from image_cache import DecodedImageCache
+from metrics import incr, metrics, span
+from output_encoder import encode_image, mime_type, resolve_format
+
+load_dotenv()
+
+HOST = os.getenv('RENDER_HOST', '127.0.0.1')
+PORT = int(os.getenv('RENDER_PORT', 8080))
+CACHE_BYTES = int(os.getenv('RENDER_CACHE_MB', 256)) * 1024 * 1024
+# Playlists are read again from Spotify after this many seconds
+PLAYLIST_TTL = float(os.getenv('RENDER_PLAYLIST_TTL', 300))
+# Largest canvas edge a request may ask for
+MAX_EDGE = int(os.getenv('RENDER_MAX_EDGE', 8192))
+# Identical requests wait this long for a running render before giving up
+RENDER_TIMEOUT = float(os.getenv('RENDER_TIMEOUT', 120))
+
+class RequestError(Exception):
+    """Invalid render request, answered with the given HTTP status"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class OutputCache:
+    """LRU of encoded collages, bounded by their total size in bytes"""
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        # Cover IDs each entry was rendered from, see discard_cover
+        self.covers = {}
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+            return data
+
+    def put(self, key, data, covers=()):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = data
+            self.covers[key] = frozenset(covers)
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                evicted_key, evicted = self.entries.popitem(last=False)
+                del self.covers[evicted_key]
+                self.size -= len(evicted)
+
+    def discard_cover(self, cover):
+        """Drop every entry rendered from the cover ID"""
+        with self.lock:
+            for key in [key for key, covers in self.covers.items() if cover in covers]:
+                self.size -= len(self.entries.pop(key))
+                del self.covers[key]
+
+class RenderService:
+    """Turns render requests into encoded collages, sharing all caches across requests"""
+
+    def __init__(self, store=None, cache=None, output_cache=None):
+        self.store = store or CoverStore()
+        self.cache = cache or DecodedImageCache()
+        self.outputs = output_cache or OutputCache()
+        # A playlist refresh may download changed artwork to the same path
+        self.store.on_change = self.cover_changed
+        self.playlists = {}
+        self.playlist_loads = {}
+        self.plan_keys = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def cover_changed(self, path):
+        """Forget decoded and rendered versions of a cover whose file was replaced"""
+        incr('render_covers_changed')
+        self.cache.discard(path)
+        self.outputs.discard_cover(collage_maker.cover_id(path))
+
+    def playlist_covers(self, name):
+        """Stored cover paths of a playlist, refreshed after PLAYLIST_TTL
+
+        Concurrent requests for the same playlist share one refresh.
+        """
+        with self.lock:
+            entry = self.playlists.get(name)
+            if entry and time.monotonic() - entry[0] < PLAYLIST_TTL:
+                return entry[1]
+            future = self.playlist_loads.get(name)
+            owner = future is None
+            if owner:
+                future = self.playlist_loads[name] = Future()
+        if not owner:
+            incr('render_playlist_coalesced')
+            try:
+                return future.result(RENDER_TIMEOUT)
+            except TimeoutError:
+                raise RequestError("Zeitüberschreitung beim Laden der Playlist", 504) from None
+
+        try:
+            paths = self.load_playlist(name)
+            future.set_result(paths)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.playlist_loads[name]
+        return paths
+
+    def load_playlist(self, name):
+        with span('render_playlist'):
+            records = list(playlist_analyzer.iter_playlist_albums(name))
+            if not records:
+                raise RequestError(f"Playlist '{name}' nicht gefunden oder leer", 404)
+            with ThreadPoolExecutor(max_workers=cover_downloader.concurrency) as executor:
+                stored = executor.map(lambda record: cover_downloader.store_album(record, self.store),
+                                      records)
+                paths = []
+                for path, _ in stored:
+                    if path and path not in paths:
+                        paths.append(path)
+            self.store.flush()
+        with self.lock:
+            self.playlists[name] = (time.monotonic(), paths)
+        return paths
+
+    def cover_path(self, cover):
+        """Accept stored cover IDs and paths of files inside the cover store
+
+        Anything outside the store is answered like a missing cover, so
+        requests cannot probe or embed other files of the server.
+        """
+        if not isinstance(cover, str) or not cover:
+            raise RequestError("covers muss eine Liste von Cover-IDs sein")
+        if os.path.sep in cover or '/' in cover or cover.endswith('.jpg'):
+            path = cover
+        else:
+            path = self.store.path_for(cover)
+        root = os.path.realpath(self.store.root)
+        path = os.path.realpath(path)
+        if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+            raise RequestError(f"Cover nicht gefunden: {cover}", 404)
+        return path
+
+    def resolve(self, request):
+        """Validate a request and return (paths by cover ID, canvas size, seed, style)"""
+        # Checked before any cover is fetched; plan_layout relies on valid values
+        if not isinstance(request.get('style') or {}, dict):
+            raise RequestError("style muss ein JSON-Objekt sein")
+        style = collage_maker.layout_style(request.get('style'))
+        try:
+            resolve_style(style)
+        except ValueError as e:
+            raise RequestError(str(e)) from None
+
+        if request.get('playlist'):
+            covers = self.playlist_covers(request['playlist'])
+        elif request.get('covers'):
+            if not isinstance(request['covers'], list):
+                raise RequestError("covers muss eine Liste von Cover-IDs sein")
+            covers = [self.cover_path(cover) for cover in request['covers']]
+        else:
+            raise RequestError("'playlist' oder 'covers' fehlt")
+        paths = {collage_maker.cover_id(path): path for path in covers}
+
+        default_width, default_height = collage_maker.canvas_size()
+        try:
+            width = int(request.get('width', default_width))
+            height = int(request.get('height', default_height))
+            seed = collage_maker.resolve_seed(request.get('seed'))
+        except (TypeError, ValueError):
+            raise RequestError("width, height und seed müssen Zahlen sein") from None
+        if not (0 < width <= MAX_EDGE and 0 < height <= MAX_EDGE):
+            raise RequestError(f"Größe muss zwischen 1 und {MAX_EDGE} px liegen")
+        return paths, (width, height), seed, style
+
+    def encoding(self, request):
+        """Validate the output options of a request: (format, quality, max bytes)"""
+        try:
+            fmt = resolve_format(fmt=str(request['format']) if request.get('format') else None)
+        except ValueError as e:
+            raise RequestError(str(e)) from None
+        try:
+            quality = int(request['quality']) if request.get('quality') is not None else None
+            max_kb = float(request['max_kb']) if request.get('max_kb') is not None else None
+        except (TypeError, ValueError, OverflowError):
+            raise RequestError("quality und max_kb müssen Zahlen sein") from None
+        if quality is not None and not 1 <= quality <= 100:
+            raise RequestError("quality muss zwischen 1 und 100 liegen")
+        if max_kb is not None and not (math.isfinite(max_kb * 1024) and max_kb > 0):
+            raise RequestError("max_kb muss eine positive Zahl sein")
+        return fmt, quality, int(max_kb * 1024) if max_kb else None
+
+    def plan(self, paths, canvas, seed, style):
+        try:
+            features = collage_maker.layout_features(list(paths.values()), style)
+            with span('layout'):
+                return plan_layout(list(paths), canvas, seed, style, features)
+        except ValueError as e:
+            raise RequestError(str(e)) from None
+
+    def render(self, plan, paths, encoding):
+        canvas = collage_maker.render_plan(plan, paths, self.cache)
+        data, _ = encode_image(canvas, *encoding)
+        return data
+
+    def handle(self, request):
+        """Return (image bytes, MIME type, plan hash, 'hit' | 'miss' | 'coalesced')"""
+        paths, canvas, seed, style = self.resolve(request)
+        encoding = self.encoding(request)
+        content_type = mime_type(encoding[0])
+        # The plan is a pure function of these parameters
+        params = json.dumps([list(paths.items()), canvas, seed, style], sort_keys=True)
+        with self.lock:
+            key = self.plan_keys.get(params)
+        if key is not None:
+            data = self.outputs.get((key, encoding))
+            if data is not None:
+                incr('render_output_hits')
+                return data, content_type, key, 'hit'
+
+        plan = self.plan(paths, canvas, seed, style)
+        key = plan_hash(plan)
+        with self.lock:
+            self.plan_keys[params] = key
+            while len(self.plan_keys) > 4 * max(1, len(self.outputs.entries)) + 64:
+                self.plan_keys.popitem(last=False)
+
+        # One plan can be cached in several encodings
+        output_key = (key, encoding)
+        data = self.outputs.get(output_key)
+        if data is not None:
+            incr('render_output_hits')
+            return data, content_type, key, 'hit'
+
+        with self.lock:
+            future = self.inflight.get(output_key)
+            owner = future is None
+            if owner:
+                future = self.inflight[output_key] = Future()
+        if not owner:
+            incr('render_coalesced')
+            try:
+                return future.result(RENDER_TIMEOUT), content_type, key, 'coalesced'
+            except TimeoutError:
+                raise RequestError("Zeitüberschreitung beim Warten auf das Rendern", 504) from None
+
+        incr('render_output_misses')
+        try:
+            with span('render_request'):
+                data = self.render(plan, paths, encoding)
+            self.outputs.put(output_key, data, paths)
+            future.set_result(data)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[output_key]
+        return data, content_type, key, 'miss'
+
+    def stats(self):
+        return {
+            'output_cache': {'entries': len(self.outputs.entries), 'bytes': self.outputs.size},
+            'image_cache': {'entries': len(self.cache.entries), 'bytes': self.cache.size,
+                            'hits': self.cache.hits, 'misses': self.cache.misses},
+            'playlists': sorted(self.playlists),
+            'metrics': metrics.snapshot(),
+        }
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are separate writes; with Nagle's algorithm the body
+        # waits for the client's delayed ACK on kept-alive connections
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def send(self, status, body, content_type='application/json', headers=None):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, status, data):
+            self.send(status, json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+        def do_GET(self):
+            if self.path == '/stats':
+                return self.send_json(200, service.stats())
+            if self.path == '/health':
+                return self.send_json(200, {'status': 'ok'})
+            self.send_json(404, {'error': 'Nicht gefunden'})
+
+        def do_POST(self):
+            if self.path != '/render':
+                return self.send_json(404, {'error': 'Nicht gefunden'})
+            start = time.perf_counter()
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+                if not isinstance(request, dict):
+                    raise RequestError("JSON-Objekt erwartet")
+                data, content_type, key, source = service.handle(request)
+            except json.JSONDecodeError:
+                return self.send_json(400, {'error': 'Ungültiges JSON'})
+            except RequestError as e:
+                return self.send_json(e.status, {'error': str(e)})
+            except Exception as e:
+                print(f"❌ Render-Fehler: {e}")
+                return self.send_json(500, {'error': str(e)})
+            elapsed = time.perf_counter() - start
+            self.send(200, data, content_type, {
+                'X-Plan-Hash': key,
+                'X-Cache': source,
+                'X-Render-Time': f"{elapsed * 1000:.1f}ms",
+            })
+
+    return Handler
+
+def make_server(host=HOST, port=PORT, service=None):
+    server = ThreadingHTTPServer((host, port), make_handler(service or RenderService()))
+    server.daemon_threads = True
+    return server
+
+def main(host=HOST, port=PORT):
+    server = make_server(host, port)
+    host, port = server.server_address[:2]
+    print(f"🎨 Render-Server läuft auf http://{host}:{port}/ (POST /render, GET /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nServer beendet.")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
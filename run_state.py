@@ -0,0 +1,174 @@
+"""
+Resumable run state
+===================
+
+A run keeps its progress in a checkpoint folder (RUN_STATE_DIR, default
+.covermix_run, with one subfolder per command), so rerunning after a
+network drop or an expired token continues where the previous run stopped:
+
+- pages.jsonl    one line per fetched playlist page: its new albums and the next page URL
+- covers.jsonl   one line per stored cover: album key and file
+- plan.json      the collage layout, so the resumed run renders the same collage
+- render.json    how many tiles the saved partial canvas (canvas-<n>.png) holds
+
+Journal lines are appended and flushed one by one; a line cut off by a crash
+is skipped when reading. Search results need no entry here, the lookup
+cache (cover_cache) keeps them already. A run for another playlist or
+output, or a state older than RUN_STATE_MAX_AGE hours, starts over; a run
+that finished without failures removes the folder.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+
+from PIL import Image
+
+from cover_store import atomic_write, read_json
+
+STATE_VERSION = 1
+DEFAULT_ROOT = '.covermix_run'
+# The partial canvas is saved at most this often while rendering
+CHECKPOINT_SECONDS = float(os.getenv('RUN_CHECKPOINT_SECONDS', 30))
+MAX_AGE_HOURS = float(os.getenv('RUN_STATE_MAX_AGE', 24))
+
+def read_journal(path):
+    """Entries of a JSON Lines journal, skipping lines cut off by a crash"""
+    entries = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return entries
+
+def last_byte_is_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+class RunState:
+    """Checkpoints of one run, identified by a JSON-able description such as playlist and output"""
+
+    def __init__(self, run, name='pipeline', root=None, fresh=False):
+        self.root = os.path.join(root or os.getenv('RUN_STATE_DIR', DEFAULT_ROOT), name)
+        self.run = run
+        self.lock = threading.Lock()
+        self.journals = {}
+
+        meta = read_json(self.file('meta.json'))
+        stale = (not meta or meta.get('version') != STATE_VERSION or meta.get('run') != run
+                 or time.time() - meta.get('created', 0) > MAX_AGE_HOURS * 3600)
+        if fresh or stale:
+            self.reset()
+        self.pages = read_journal(self.file('pages.jsonl'))
+        self.covers = {entry['key']: entry.get('path') for entry in read_journal(self.file('covers.jsonl'))}
+        self.resumed = bool(self.pages or self.covers)
+
+    def file(self, name):
+        return os.path.join(self.root, name)
+
+    def reset(self):
+        """Drop all checkpoints and start a new state for this run"""
+        self.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root, exist_ok=True)
+        meta = {'version': STATE_VERSION, 'run': self.run, 'created': time.time()}
+        atomic_write(self.file('meta.json'), json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+    def append(self, name, entry):
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self.lock:
+            f = self.journals.get(name)
+            if f is None:
+                path = self.file(name)
+                f = self.journals[name] = open(path, 'a', encoding='utf-8')
+                # Start on a fresh line if the last run died mid-write
+                if f.tell() and not last_byte_is_newline(path):
+                    f.write('\n')
+            f.write(line)
+            f.flush()
+
+    def close(self):
+        with self.lock:
+            for f in self.journals.values():
+                f.close()
+            self.journals = {}
+
+    # Playlist pages
+
+    def fetch_position(self):
+        """(records of all saved pages, URL of the next page, fetch complete)"""
+        records = [record for page in self.pages for record in page['records']]
+        if not self.pages:
+            return records, None, False
+        next_url = self.pages[-1]['next']
+        return records, next_url, next_url is None
+
+    def add_page(self, records, next_url):
+        self.append('pages.jsonl', {'records': records, 'next': next_url})
+
+    # Stored covers
+
+    def cover(self, key):
+        """Whether the cover of key was stored; returns its path (None if not recorded)"""
+        with self.lock:
+            return key in self.covers, self.covers.get(key)
+
+    def add_cover(self, key, path=None):
+        with self.lock:
+            self.covers[key] = path
+        self.append('covers.jsonl', {'key': key, 'path': path})
+
+    # Layout and render progress
+
+    def load_plan(self):
+        """{'plan', 'covers'} as saved by save_plan, or None"""
+        return read_json(self.file('plan.json'))
+
+    def save_plan(self, plan, covers):
+        """Save the layout together with the cover IDs it was planned for"""
+        data = json.dumps({'plan': plan, 'covers': covers}, ensure_ascii=False)
+        atomic_write(self.file('plan.json'), data.encode('utf-8'))
+
+    def load_render(self, key):
+        """(tiles done, partial canvas) saved for the plan with hash key, or None"""
+        progress = read_json(self.file('render.json'))
+        if not progress or progress.get('plan') != key:
+            return None
+        try:
+            with Image.open(self.file(progress['canvas'])) as img:
+                return progress['tiles'], img.convert('RGB')
+        except OSError:
+            return None
+
+    def save_render(self, key, tiles, canvas):
+        """Save the canvas after the first tiles of the plan with hash key have been painted"""
+        name = f"canvas-{tiles}.png"
+        # Fast zlib level: the checkpoint is rewritten during the render
+        canvas.save(self.file(name), 'PNG', compress_level=1)
+        previous = read_json(self.file('render.json'))
+        progress = {'plan': key, 'tiles': tiles, 'canvas': name}
+        atomic_write(self.file('render.json'), json.dumps(progress).encode('utf-8'))
+        # Only now the new canvas is referenced, the old one can go
+        if previous and previous.get('canvas') not in (None, name):
+            try:
+                os.remove(self.file(previous['canvas']))
+            except OSError:
+                pass
+
+    def finish(self):
+        """The run completed; remove its checkpoints"""
+        self.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+        try:
+            # The parent folder goes once no other command has a state in it
+            os.rmdir(os.path.dirname(self.root))
+        except OSError:
+            pass
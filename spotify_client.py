@@ -0,0 +1,174 @@
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from dotenv import load_dotenv
+
+from metrics import incr, observe, span
+
+# Load environment variables from .env file
+load_dotenv()
+
+API_BASE = os.getenv('SPOTIFY_API_BASE', 'https://api.spotify.com/')
+
+# Status codes that are worth another attempt
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+class SpotifyAPIError(Exception):
+    """Raised when a request still fails after all retries"""
+
+    def __init__(self, status, message, url):
+        super().__init__(f"{status} {message}")
+        self.status = status
+        self.message = message
+        self.url = url
+
+class TokenBucket:
+    """Thread-safe token bucket that spaces requests to a steady rate
+
+    A rate of 0 or less means no limit; pause still holds callers back.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.rate <= 0:
+                    return
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold back every caller for the given time (used for Retry-After)"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.blocked_until
+
+class SpotifyClient:
+    """Shared HTTP client with rate limiting, retries and keep-alive pooling"""
+
+    def __init__(self, token=None, rate=None, burst=None, max_retries=None,
+                 timeout=None, pool_size=None, api_base=None):
+        self.token = token or os.getenv('SPOTIFY_TOKEN')
+        self.api_base = api_base or API_BASE
+        rate = float(rate if rate is not None else os.getenv('SPOTIFY_RATE_LIMIT', 10))
+        self.bucket = TokenBucket(rate, burst or os.getenv('SPOTIFY_BURST'))
+        self.max_retries = int(max_retries if max_retries is not None else os.getenv('SPOTIFY_MAX_RETRIES', 5))
+        self.timeout = float(timeout or os.getenv('SPOTIFY_TIMEOUT', 10))
+        self.backoff_base = 0.5
+        self.backoff_cap = 30.0
+
+        pool_size = int(pool_size or os.getenv('DOWNLOAD_CONCURRENCY', 8))
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff delay for the given attempt"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def request(self, method, url, api=True, **kwargs):
+        """Send a request, retrying throttled, failed and timed-out attempts"""
+        kwargs.setdefault('timeout', self.timeout)
+        if api:
+            headers = dict(kwargs.pop('headers', None) or {})
+            headers['Authorization'] = f'Bearer {self.token}'
+            kwargs['headers'] = headers
+
+        kind = 'api' if api else 'http'
+        attempt = 0
+        while True:
+            if api:
+                with span('rate_limit_wait'):
+                    self.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                incr(f'{kind}_connection_errors')
+                if attempt >= self.max_retries:
+                    raise SpotifyAPIError(None, str(e), url) from e
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+                incr(f'{kind}_retries')
+                continue
+            observe(f'{kind}_request', time.perf_counter() - start)
+            incr(f'{kind}_requests')
+
+            if response.status_code not in RETRY_STATUS:
+                if response.status_code >= 400:
+                    incr(f'{kind}_errors')
+                    raise SpotifyAPIError(response.status_code, response.reason, url)
+                return response
+
+            if attempt >= self.max_retries:
+                incr(f'{kind}_errors')
+                raise SpotifyAPIError(response.status_code, response.reason, url)
+
+            delay = self.backoff(attempt)
+            if response.status_code == 429:
+                incr(f'{kind}_throttled')
+                retry_after = response.headers.get('Retry-After')
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+                # Throttling applies to the whole app, so slow down every thread
+                self.bucket.pause(delay)
+            response.close()
+            time.sleep(delay)
+            attempt += 1
+            incr(f'{kind}_retries')
+
+    def fetch_web_api(self, endpoint, method='GET', body=None, params=None):
+        """Call a Web API endpoint (relative or absolute URL) and return the JSON body"""
+        # Paging links from Spotify are absolute URLs, endpoints are relative
+        url = endpoint if endpoint.startswith('http') else f"{self.api_base}{endpoint}"
+        headers = {}
+        data = None
+        if method == 'POST':
+            headers['Content-Type'] = 'application/json'
+            data = json.dumps(body) if body else None
+
+        response = self.request(method, url, params=params, headers=headers, data=data)
+        if not response.content:
+            return {}
+        return response.json()
+
+    def get(self, url, **kwargs):
+        """Plain GET (e.g. for cover images) with the same retry handling"""
+        return self.request('GET', url, api=False, **kwargs)
+
+_default_client = None
+_default_lock = threading.Lock()
+
+def get_client():
+    """Return the process-wide client shared by all stages"""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = SpotifyClient()
+        return _default_client
+
+def fetch_web_api(endpoint, method, body=None, params=None):
+    return get_client().fetch_web_api(endpoint, method, body=body, params=params)